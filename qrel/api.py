@@ -1,8 +1,10 @@
 __author__='FlorianKunneman'
 
+import os
 import json
-from flask import Flask, request
+from flask import Flask, request, abort
 
+from qrel.classes import batcher
 from qrel.modules import relate
 
 # initialize Flask
@@ -10,6 +12,29 @@ app = Flask(__name__)
 
 # initialize relatedness module
 model = relate.Relate()
+model.start_refresher() # refresh the related questions of earlier questions in the background
+
+# optionally, /similar and /related requests that come in within a few milliseconds are processed together in batches,
+# set QREL_BATCH_SIZE to the maximum number of requests in a batch to turn this on
+batch_size = int(os.environ.get('QREL_BATCH_SIZE',0))
+batch_window = float(os.environ.get('QREL_BATCH_WINDOW',5)) / 1000 # milliseconds to wait for requests to join a batch
+batch_timeout = float(os.environ.get('QREL_BATCH_TIMEOUT',30)) # seconds after which a request in a batch fails
+if batch_size > 1:
+    similar_batcher = batcher.MicroBatcher(model.most_similar_batch,batch_size,batch_window,batch_timeout)
+    # related questions are added to the dataset once per batch, after they were all scored, so that adding them is never repeated
+    related_batcher = batcher.MicroBatcher(model.score_batch,batch_size,batch_window,batch_timeout,model.commit_batch)
+
+def valid(args):
+    # check the type of each given field of a request, so that a malformed request is rejected before it can fail a batch
+    if 'text' in args and not isinstance(args['text'],str):
+        return False
+    if 'id' in args and (isinstance(args['id'],bool) or not isinstance(args['id'],(str,int))):
+        return False
+    if 'n' in args and (isinstance(args['n'],bool) or not isinstance(args['n'],int) or args['n'] < 1):
+        return False
+    if 'model' in args and args['model'] not in ['bm25','softcosine','trlm','ensemble']:
+        return False
+    return True
 
 @app.route("/related", methods=['GET'])
 def rel():
@@ -20,9 +45,11 @@ def rel():
     related = {'code': 400} # initialize output
         
     if request.method == 'GET': # only works with GET
-        if not request.json or not 'text' in request.json or not 'id' in request.json: # check if input (question text and question id) is correct
+        if not request.json or not 'text' in request.json or not 'id' in request.json or not valid(request.json): # check if input (question text and question id) is correct
             abort(400)
-        if 'n' in request.json.keys(): # check if number of candidates is given as additional argument
+        if batch_size > 1: # apply question relatedness procedure in a batch with other requests
+            related = related_batcher([request.json['text'],request.json['id'],request.json.get('n',50)])
+        elif 'n' in request.json.keys(): # check if number of candidates is given as additional argument
             related = model(request.json['text'],request.json['id'],request.json['n']) # apply question relatedness procedure with given n
         else:
             related = model(request.json['text'],request.json['id']) # apply question relatedness procedure with default n
@@ -38,9 +65,11 @@ def sim():
     similar = {'code': 400} # initialize output
         
     if request.method == 'GET': # only works with GET
-        if not request.json or not 'text' in request.json: # check if input (question text) is correct
+        if not request.json or not 'text' in request.json or not valid(request.json): # check if input (question text) is correct
             abort(400)
-        if 'model' in request.json.keys(): # check if model is given as additional argument (options are 'bm25', 'softcosine', 'trlm', 'ensemble')
+        if batch_size > 1: # apply question similarity procedure in a batch with other requests
+            similar = similar_batcher([request.json['text'],request.json.get('model','ensemble')])
+        elif 'model' in request.json.keys(): # check if model is given as additional argument (options are 'bm25', 'softcosine', 'trlm', 'ensemble')
             similar = model.most_similar(request.json['text'],request.json['model']) # apply question similarity procedure with given model
         else:
             similar = model.most_similar(request.json['text']) # apply question simlarity procedure with default model (ensemble)
@@ -52,12 +81,26 @@ def sim():
 def update():
     """
     update dataset by applying question relatedness to questions that were found related to new questions
+    The questions are refreshed in the background, this call only starts the refresh right away and returns the state of the queue
     """
 
     if request.method == 'GET':
-        model.update_candidates()
+        model.refresher.wake()
+
+    return json.dumps(model.refresher.stats())
+
+@app.route("/stats", methods=['GET'])
+def stats():
+    """
+    :return: the hit counters of the cache with preprocessed question texts and of the cache with the output of /similar,
+        the version of the index, the time it took to load each model 
+        and the depth and lag of the queue of questions to refresh (and the number of batches, if requests are batched)
+    """
 
-    return 'updated succesfully and written to files'
+    output = {'cache':model.cache.stats(),'results':model.results.stats(),'index_version':model.qs.version.number,'load_times':model.loader.times,'refresh':model.refresher.stats()}
+    if batch_size > 1:
+        output['batches'] = {'similar':similar_batcher.stats(),'related':related_batcher.stats()}
+    return json.dumps(output)
 
 # start-up api, by running python api.py
 if __name__ == '__main__':
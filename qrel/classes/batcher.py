@@ -0,0 +1,89 @@
+
+import time
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError
+
+class MicroBatcher:
+    """
+    Class to process requests that come in at about the same time together, in batches
+    A request waits at most window seconds for other requests to join its batch, and a batch holds at most max_batch requests;
+        the batches are processed one at a time in a background thread, by a function (process) that takes a list of requests
+        and returns a list with the result of each of them, which is handed back to the thread that submitted the request
+    If a batch fails, its requests are processed again one at a time, so that a bad request only fails itself;
+        a request that is not processed within timeout seconds fails with a TimeoutError (and is skipped if it was still waiting)
+    Processing should not change any state, as it may be repeated; changes are made by an optional second function (commit),
+        which takes the results of the requests that were processed, applies them at once and returns the output of each request
+        (it is never repeated: if it fails, all of these requests fail)
+    """
+
+    def __init__(self,process,max_batch=16,window=0.005,timeout=30,commit=False):
+        self.process = process
+        self.commit = commit
+        self.max_batch = max_batch
+        self.window = window
+        self.timeout = timeout
+        self.requests = queue.Queue() # pairs of a request and the future in which its result is set
+        self.batches = 0
+        self.processed = 0
+        self.retried = 0
+        self.thread = threading.Thread(target=self.run,daemon=True)
+        self.thread.start()
+
+    def __call__(self,request):
+        # submit a request, and return its result once the batch it was added to is processed
+        future = Future()
+        self.requests.put((request,future))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel() # only succeeds if the request is still waiting, it is then skipped
+            raise
+
+    def collect(self):
+        # wait for a request, and collect the requests that come in within the window after it
+        batch = [self.requests.get()]
+        deadline = time.time() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = [(request,future) for request,future in self.collect() if future.set_running_or_notify_cancel()] # skip requests that timed out
+            if len(batch) == 0:
+                continue
+            try:
+                processed = list(zip([future for request,future in batch],self.process([request for request,future in batch])))
+            except Exception as e: # process the requests one at a time, so that only the requests that fail by themselves fail
+                print('Processing a batch of',len(batch),'requests failed, processing them one at a time:',e)
+                self.retried += 1
+                processed = []
+                for request,future in batch:
+                    try:
+                        processed.append((future,self.process([request])[0]))
+                    except Exception as e:
+                        future.set_exception(e)
+            if self.commit and len(processed) > 0:
+                try:
+                    processed = list(zip([future for future,result in processed],self.commit([result for future,result in processed])))
+                except Exception as e:
+                    print('Committing a batch of',len(processed),'requests failed:',e)
+                    for future,result in processed:
+                        future.set_exception(e)
+                    processed = []
+            for future,result in processed:
+                future.set_result(result)
+            self.batches += 1
+            self.processed += len(batch)
+
+    def stats(self):
+        # return the number of processed batches and requests, the average number of requests per batch and the number of failed batches
+        return {'batches':self.batches,'requests':self.processed,'average_size':float(self.processed) / self.batches if self.batches else 0.0,
+            'retried':self.retried}
@@ -0,0 +1,131 @@
+
+import re
+import time
+import sqlite3
+import threading
+import unicodedata
+import _pickle as p
+from collections import OrderedDict
+
+WHITESPACE = re.compile(r'\s+')
+
+def normalize(text):
+    # normalize a text to use it as a cache key: unicode NFC normalization, and whitespace collapsed to single spaces
+    return WHITESPACE.sub(' ',unicodedata.normalize('NFC',text)).strip()
+
+class LRUCache:
+    """
+    Class to cache values by key, with a limited size: when it is full, the least recently used value is evicted
+    If a path is given, values are also stored in an sqlite database on disk (without a size limit),
+        which is consulted for keys that are not in memory; the database is emptied when it was written with another version
+    The number of hits (in memory and on disk) and misses are counted
+    """
+
+    def __init__(self,maxsize=10000,path=False,version=''):
+        self.maxsize = maxsize
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.db = False
+        if path:
+            self.open_db(path,version)
+
+    def __len__(self):
+        return len(self.values)
+
+    def open_db(self,path,version):
+        # open the on-disk tier, emptying it if it was written with another version of the cached values
+        self.db = sqlite3.connect(path,check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (version TEXT)')
+        stored = self.db.execute('SELECT version FROM meta').fetchone()
+        if stored is None or stored[0] != version:
+            self.db.execute('DELETE FROM cache')
+            self.db.execute('DELETE FROM meta')
+            self.db.execute('INSERT INTO meta VALUES (?)',(version,))
+        self.db.commit()
+
+    def get(self,key):
+        # return the value cached for a key, or None if it is not cached
+        with self.lock:
+            if key in self.values:
+                self.values.move_to_end(key)
+                self.hits += 1
+                return self.values[key]
+            if self.db:
+                row = self.db.execute('SELECT value FROM cache WHERE key = ?',(key,)).fetchone()
+                if row is not None:
+                    value = p.loads(row[0])
+                    self.store(key,value)
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self,key,value):
+        # cache a value for a key
+        with self.lock:
+            self.store(key,value)
+            if self.db:
+                self.db.execute('INSERT OR REPLACE INTO cache VALUES (?,?)',(key,p.dumps(value)))
+                self.db.commit()
+
+    def store(self,key,value):
+        # store a value in memory, evicting the least recently used value if the cache is full
+        self.values[key] = value
+        self.values.move_to_end(key)
+        while len(self.values) > self.maxsize:
+            self.values.popitem(last=False)
+
+    def stats(self):
+        # return the size of the cache and its hit counters
+        lookups = self.hits + self.disk_hits + self.misses
+        return {'size':len(self.values),'hits':self.hits,'disk_hits':self.disk_hits,'misses':self.misses,
+            'hit_rate':float(self.hits + self.disk_hits) / lookups if lookups else 0.0}
+
+class ResultCache(LRUCache):
+    """
+    Class to cache results that depend on the version of an index (such as the most similar questions to a question),
+        with a limited size (the least recently used result is evicted) and a limited age (ttl, in seconds)
+    Each result is stored with the number of the version of the index it was computed with: a result computed with an earlier
+        version is stale, and still returned if it is at most max_stale versions behind (by default it is evicted)
+    The number of hits (on the current version and stale), misses and evicted results are counted
+    """
+
+    def __init__(self,maxsize=10000,ttl=3600,max_stale=0):
+        LRUCache.__init__(self,maxsize)
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.stale_hits = 0
+        self.evicted = 0
+
+    def get(self,key,version):
+        # return the result cached for a key that is recent enough for the given version of the index, or None
+        with self.lock:
+            if key in self.values:
+                stored_version, stored_time, value = self.values[key]
+                if version - stored_version > self.max_stale or time.time() - stored_time > self.ttl:
+                    del self.values[key]
+                    self.evicted += 1
+                else:
+                    self.values.move_to_end(key)
+                    if stored_version == version:
+                        self.hits += 1
+                    else:
+                        self.stale_hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self,key,version,value):
+        # cache a result for a key, computed with the given version of the index
+        with self.lock:
+            self.store(key,(version,time.time(),value))
+
+    def stats(self):
+        # return the size of the cache and its hit counters
+        lookups = self.hits + self.stale_hits + self.misses
+        return {'size':len(self.values),'hits':self.hits,'stale_hits':self.stale_hits,'misses':self.misses,'evicted':self.evicted,
+            'hit_rate':float(self.hits + self.stale_hits) / lookups if lookups else 0.0}
@@ -0,0 +1,165 @@
+
+import copy
+import bisect
+import numpy as np
+
+from qrel.classes import growable
+
+class DenseIndex:
+    """
+    class to find the nearest neighbours of a vector among many vectors of unit length, by their inner product (cosine similarity)
+    The vectors are searched approximately with an inverted file index (IVF): they are clustered by k-means,
+        and a query is only compared to the vectors in the nprobe clusters of which the centroid is nearest
+    The vectors of each cluster are listed in a CSR layout: the vectors of cluster c are ids[indptr[c]:indptr[c+1]];
+        vectors added after the lists were built are assigned to their nearest centroid and kept in a delta,
+        which is merged into the lists once it grows too large
+    Read-only versions of the index (see freeze) share all arrays with it
+    """
+
+    def __init__(self,dim,nprobe=16,max_delta=0.1):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.max_delta = max_delta # fraction of listed vectors in the delta at which it is merged into the lists
+        self.vectors = growable.GrowableArray(np.float32) # the vectors, one after the other
+        self.size = 0 # the number of vectors
+        self.centroids = np.zeros((1,dim),dtype=np.float32) # a single cluster, until the index is built
+        self.indptr = np.zeros(2,dtype=np.int64)
+        self.ids = np.zeros(0,dtype=np.int32)
+        self.delta = {} # cluster -> [ids of the vectors added to the cluster after the lists were built]
+        self.delta_size = 0
+
+    def __len__(self):
+        return self.size
+
+    def matrix(self):
+        # return the vectors as a matrix with one row per vector (a view, not a copy)
+        return self.vectors.values()[:self.size*self.dim].reshape(self.size,self.dim)
+
+    def build(self,vectors,nlist=False,iterations=10,sample=50000):
+        """
+        Function to build the index for the given vectors, clustered in nlist clusters (by default the square root of their number)
+        The centroids are trained by spherical k-means on a sample of the vectors
+        """
+        vectors = np.asarray(vectors,dtype=np.float32).reshape(-1,self.dim)
+        self.vectors = growable.GrowableArray(np.float32,vectors.ravel())
+        self.size = len(vectors)
+        if self.size > 0:
+            self.centroids = self.kmeans(vectors,nlist if nlist else max(1,int(np.sqrt(self.size))),iterations,sample)
+        clusters = self.assign(vectors)
+        self.ids = np.argsort(clusters,kind='stable').astype(np.int32)
+        self.indptr = np.zeros(len(self.centroids)+1,dtype=np.int64)
+        np.cumsum(np.bincount(clusters,minlength=len(self.centroids)),out=self.indptr[1:])
+        self.delta = {}
+        self.delta_size = 0
+
+    def kmeans(self,vectors,nlist,iterations,sample):
+        # return the centroids of nlist clusters of the given vectors (or a sample of them), by spherical k-means
+        random = np.random.RandomState(0)
+        if len(vectors) > sample:
+            vectors = vectors[random.choice(len(vectors),sample,replace=False)]
+        nlist = min(nlist,len(vectors))
+        centroids = vectors[random.choice(len(vectors),nlist,replace=False)].copy()
+        for i in range(iterations):
+            clusters = self.assign(vectors,centroids)
+            sums = np.zeros(centroids.shape,dtype=np.float64)
+            np.add.at(sums,clusters,vectors)
+            norms = np.linalg.norm(sums,axis=1)
+            filled = norms > 0 # empty clusters keep their centroid
+            centroids[filled] = (sums[filled] / norms[filled,np.newaxis]).astype(np.float32)
+        return centroids
+
+    def assign(self,vectors,centroids=None,chunksize=10000):
+        # return the cluster with the nearest centroid of each vector, computed in chunks to limit memory use
+        centroids = self.centroids if centroids is None else centroids
+        clusters = np.zeros(len(vectors),dtype=np.int64)
+        for start in range(0,len(vectors),chunksize):
+            clusters[start:start+chunksize] = vectors[start:start+chunksize].dot(centroids.T).argmax(axis=1)
+        return clusters
+
+    def add(self,vector):
+        # add a vector to the index, in the delta of the cluster with the nearest centroid; returns the index of the vector
+        vector = np.asarray(vector,dtype=np.float32)
+        c = int(self.centroids.dot(vector).argmax())
+        index = self.size
+        self.vectors.extend(vector)
+        if c not in self.delta:
+            self.delta[c] = []
+        self.delta[c].append(index)
+        self.size += 1
+        self.delta_size += 1
+        if self.delta_size > self.max_delta * len(self.ids):
+            self.compact()
+        return index
+
+    def compact(self):
+        """
+        Function to merge the vectors in the delta into the lists of their clusters
+        The lists are replaced rather than changed, so that versions of the index that share them are not affected
+        """
+        if not self.delta:
+            return
+        nlist = len(self.centroids)
+        counts = np.diff(self.indptr)
+        delta_counts = np.zeros(nlist,dtype=np.int64)
+        for c,ids in self.delta.items():
+            delta_counts[c] = len(ids)
+        indptr = np.zeros(nlist+1,dtype=np.int64)
+        np.cumsum(counts+delta_counts,out=indptr[1:])
+        ids = np.empty(indptr[-1],dtype=np.int32)
+        # move the listed vectors to their new position, and append the vectors in the delta
+        clusters = np.repeat(np.arange(nlist),counts)
+        ids[np.arange(len(self.ids)) - self.indptr[clusters] + indptr[clusters]] = self.ids
+        for c,delta_ids in self.delta.items():
+            start = indptr[c] + counts[c]
+            ids[start:start+delta_counts[c]] = delta_ids
+        self.indptr, self.ids = indptr, ids
+        self.delta = {}
+        self.delta_size = 0
+
+    def freeze(self):
+        # return a read-only version of the index with the vectors added so far; vectors added after it are skipped
+        version = copy.copy(self)
+        version.vectors = growable.GrowableArray(np.float32)
+        version.vectors.attach(self.vectors.values())
+        return version
+
+    def search(self,vector,n,nprobe=False):
+        """
+        Function to return the n vectors with the highest inner product with a given vector, among the vectors in the nprobe clusters
+            of which the centroid is nearest, as a list of [index, score] (ties are ranked by index)
+        """
+        n = min(n,self.size)
+        if n <= 0:
+            return []
+        vector = np.asarray(vector,dtype=np.float32)
+        nprobe = min(nprobe if nprobe else self.nprobe,len(self.centroids))
+        probe = np.argpartition(-self.centroids.dot(vector),nprobe-1)[:nprobe]
+        ids = [self.ids[self.indptr[c]:self.indptr[c+1]] for c in probe]
+        for c in probe:
+            if c in self.delta:
+                delta_ids = self.delta[c]
+                ids.append(np.asarray(delta_ids[:bisect.bisect_left(delta_ids,self.size)],dtype=np.int32))
+        ids = np.concatenate(ids).astype(np.int64)
+        scores = self.matrix()[ids].dot(vector)
+        if len(scores) > n:
+            selection = np.argpartition(-scores,n-1)[:n]
+            kth = scores[selection].min() # include all vectors that tie at the cutoff, so that ties are ranked by index
+            selection = np.flatnonzero(scores >= kth)
+            ids, scores = ids[selection], scores[selection]
+        order = np.lexsort((ids,-scores))[:n]
+        return [[i,score] for i,score in zip(ids[order].tolist(),scores[order].tolist())]
+
+    def export(self):
+        # return the index as a dictionary of arrays (after merging the delta into the lists), to store it in a file
+        self.compact()
+        return {'vectors':self.vectors.values(),'centroids':self.centroids,'indptr':self.indptr,'ids':self.ids}
+
+    def restore(self,arrays):
+        # restore an index stored in a file, without copying its arrays (the vectors are copied when the first vector is added)
+        self.vectors.attach(arrays['vectors'])
+        self.centroids = arrays['centroids']
+        self.dim = self.centroids.shape[1]
+        self.size = len(arrays['vectors']) // self.dim
+        self.indptr, self.ids = arrays['indptr'], arrays['ids']
+        self.delta = {}
+        self.delta_size = 0
@@ -0,0 +1,149 @@
+
+import os
+import json
+import numpy as np
+
+from qrel.classes import snapshot
+
+class EmbeddingStore:
+    """
+    class to store the word embeddings of all questions in one contiguous float32 array (one row per token),
+    with an array of offsets that marks where the tokens of each question start
+    Both arrays are written to disk and opened with numpy.memmap: questions get zero-copy views on their embeddings,
+    and worker processes that open the same files share one copy in the page cache
+    Embeddings of added questions are kept in memory, also after they are appended to the files (see flush);
+        the files are only opened again when remap is called, so that all questions share a single memory map
+    The signatures of the model files the embeddings were computed with (sources) are stored with them,
+        the store is outdated if one of these files has changed since
+    """
+
+    def __init__(self,path,dim=300,sources={}):
+        self.metapath = path + '.json'
+        self.vectorspath = path + '.vectors.f32'
+        self.offsetspath = path + '.offsets.i64'
+        self.dim = dim
+        self.sources = sources # name -> path of a model file the embeddings depend on
+        self.signatures = {} # name -> signature of the model file when the embeddings were computed
+        self.vectors = np.zeros((0,dim),dtype=np.float32)
+        self.offsets = np.zeros(1,dtype=np.int64)
+        self.size = 0 # the number of questions in the store
+        self.pending = [] # embeddings of questions added since the files were last opened
+        self.written = 0 # the number of pending embeddings that were appended to the files
+
+    def __len__(self):
+        return self.size + len(self.pending)
+
+    def exists(self):
+        return os.path.exists(self.metapath) and os.path.exists(self.vectorspath) and os.path.exists(self.offsetspath)
+
+    def format(self,emb):
+        # format the embedding of a question as a float32 array with one row per token
+        return np.asarray(emb,dtype=np.float32).reshape(len(emb),self.dim)
+
+    def load(self):
+        """
+        Function to open the stored arrays with numpy.memmap
+        If writing the files was interrupted, only the questions of which all embeddings were written are used
+        """
+        with open(self.metapath,'r',encoding='utf-8') as file_in:
+            meta = json.loads(file_in.read())
+        self.dim = meta['dim']
+        self.signatures = meta.get('sources',{})
+        nrows = os.path.getsize(self.vectorspath) // (4 * self.dim)
+        if nrows > 0:
+            self.vectors = np.memmap(self.vectorspath,dtype=np.float32,mode='r',shape=(nrows,self.dim))
+        else:
+            self.vectors = np.zeros((0,self.dim),dtype=np.float32)
+        noffsets = os.path.getsize(self.offsetspath) // 8
+        if noffsets > 0:
+            self.offsets = np.memmap(self.offsetspath,dtype=np.int64,mode='r',shape=(noffsets,))
+        else:
+            self.offsets = np.zeros(1,dtype=np.int64)
+        self.size = int(np.searchsorted(self.offsets,nrows,side='right')) - 1
+        self.pending = []
+        self.written = 0
+
+    def build(self,questions,encode):
+        """
+        Function to encode all questions and write their embeddings to new files, which are then opened with numpy.memmap
+        The files are written under a temporary name and moved in place when complete
+        """
+        offsets = [0]
+        with open(self.vectorspath + '.tmp','wb') as file_out:
+            for i,q in enumerate(questions):
+                emb = self.format(q.emb if len(q.emb) > 0 else encode(q.tokens))
+                file_out.write(emb.tobytes())
+                offsets.append(offsets[-1] + len(emb))
+        np.array(offsets,dtype=np.int64).tofile(self.offsetspath + '.tmp')
+        with open(self.metapath,'w',encoding='utf-8') as file_out:
+            json.dump({'dim':self.dim,'dtype':'float32','sources':dict([(name,snapshot.file_signature(path)) for name,path in self.sources.items()])},file_out)
+        os.replace(self.vectorspath + '.tmp',self.vectorspath)
+        os.replace(self.offsetspath + '.tmp',self.offsetspath)
+        self.load()
+
+    def fresh(self):
+        # check if the embeddings were computed with the current version of the model files
+        return all([self.signatures.get(name) == snapshot.file_signature(path) for name,path in self.sources.items()])
+
+    def matches(self,questions):
+        """
+        Function to check if the stored embeddings belong to the given questions, by comparing the number of tokens per question
+        Questions beyond the ones in the store are no reason for a mismatch: they can be appended
+        """
+        n = min(self.size,len(questions))
+        lengths = np.array([len(q.token_ids) for q in questions[:n]],dtype=np.int64)
+        return bool((np.diff(self.offsets[:n+1]) == lengths).all())
+
+    def truncate(self,size):
+        # drop the questions from the given index onwards, they are removed from the files on the next write
+        if size < self.size:
+            self.size = size
+            self.pending = []
+        else:
+            self.pending = self.pending[:size-self.size]
+        self.written = min(self.written,len(self.pending))
+
+    def get(self,i):
+        # return the embeddings of the i-th question, as a view on the stored array (or the array in memory, for added questions)
+        if i < self.size:
+            return self.vectors[self.offsets[i]:self.offsets[i+1]]
+        return self.pending[i-self.size]
+
+    def append(self,emb):
+        # add the embeddings of a new question, returns its index in the store
+        self.pending.append(self.format(emb))
+        return len(self) - 1
+
+    def flush(self):
+        """
+        Function to append the embeddings of added questions that were not written yet to the files
+        The files are not opened again, the written embeddings are still returned from memory (see remap)
+        The vectors are written before the offsets, so that an interrupted write leaves the store consistent;
+            questions dropped by truncate are removed from the files first
+        """
+        stored = self.size + self.written
+        if self.written == len(self.pending) and os.path.getsize(self.offsetspath) == (stored + 1) * 8:
+            return
+        end = int(self.offsets[self.size]) + sum([len(emb) for emb in self.pending[:self.written]])
+        offsets = [end]
+        for emb in self.pending[self.written:]:
+            offsets.append(offsets[-1] + len(emb))
+        with open(self.vectorspath,'r+b') as file_out:
+            file_out.truncate(end * 4 * self.dim)
+            file_out.seek(0,2)
+            for emb in self.pending[self.written:]:
+                file_out.write(emb.tobytes())
+        with open(self.offsetspath,'r+b') as file_out:
+            file_out.truncate((stored + 1) * 8)
+            file_out.seek(0,2)
+            file_out.write(np.array(offsets[1:],dtype=np.int64).tobytes())
+        self.written = len(self.pending)
+
+    def remap(self):
+        """
+        Function to write the added questions, and open the files again with numpy.memmap
+        Questions should be pointed to their embeddings in the new map (see get) afterwards, so that earlier maps are released
+        """
+        self.flush()
+        if len(self.pending) > 0:
+            self.load()
@@ -0,0 +1,62 @@
+
+import functools
+import threading
+import numpy as np
+
+def vocabulary_index(kv):
+    # return a dictionary with the row of each word in the vectors of a gensim KeyedVectors object (gensim 4 and earlier versions)
+    if hasattr(kv,'key_to_index'):
+        return kv.key_to_index
+    return dict([(w,v.index) for w,v in kv.vocab.items()])
+
+class Encoder:
+    """
+    class to encode question word tokens as a matrix of word2vec embeddings (one row per token)
+    The embeddings of the words in the dictionary are copied into a pruned matrix, of which the first row is
+    a shared zero vector for unknown words; tokens are mapped to their row through an LRU cache,
+    and a question is encoded by selecting the rows of its tokens in one fancy-indexing operation
+    """
+
+    def __init__(self,w2v,d,cache_size=100000):
+        self.kv = w2v.wv if hasattr(w2v,'wv') else w2v # accept both a Word2Vec and a KeyedVectors object
+        self.dim = self.kv.vector_size
+        self.vocab = vocabulary_index(self.kv)
+        words = [w for w in d.token2id if w in self.vocab]
+        self.word2row = dict([(w,i+1) for i,w in enumerate(words)])
+        self.matrix = np.zeros((len(words)+1,self.dim),dtype=self.kv.vectors.dtype)
+        if len(words) > 0:
+            self.matrix[1:] = self.kv.vectors[[self.vocab[w] for w in words]]
+        self.nrows = len(words) + 1
+        self.lock = threading.Lock() # guards the growth of the matrix
+        self.row = functools.lru_cache(maxsize=cache_size)(self.lookup)
+
+    def lookup(self,token):
+        """
+        Function to return the row of a token in the matrix
+        Words that are known by word2vec but not in the dictionary are appended to the matrix on their first lookup
+            (by one thread at a time, the row of a word is only set once its vector is written);
+        unknown words are mapped to the zero row
+        """
+        if token in self.word2row:
+            return self.word2row[token]
+        if token in self.vocab:
+            with self.lock:
+                if token not in self.word2row: # the word may have been added by another thread in the meantime
+                    if self.nrows == len(self.matrix):
+                        matrix = np.zeros((2*self.nrows,self.dim),dtype=self.matrix.dtype)
+                        matrix[:self.nrows] = self.matrix
+                        self.matrix = matrix
+                    self.matrix[self.nrows] = self.kv.vectors[self.vocab[token]]
+                    self.word2row[token] = self.nrows
+                    self.nrows += 1
+                return self.word2row[token]
+        return 0
+
+    def rows(self,tokens):
+        # return the rows of the given tokens in the matrix
+        return [self.row(t) for t in tokens]
+
+    def encode(self,tokens):
+        # return the embeddings of the given tokens, as a matrix with one row per token
+        rows = self.rows(tokens) # looked up first, as a lookup may grow the matrix
+        return self.matrix[rows]
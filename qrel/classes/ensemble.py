@@ -1,5 +1,6 @@
 
 import _pickle as p
+import numpy as np
 from sklearn.model_selection import RandomizedSearchCV
 from sklearn.model_selection import GridSearchCV
 from sklearn.linear_model import LogisticRegression
@@ -82,6 +83,38 @@ class Ensemble:
         self.model = model['model']
         self.scaler = model['scaler']
 
+    def export(self):
+        """
+        Function to return the coefficients of the trained model and the scaler as a dictionary of arrays, to store them in a snapshot
+        """
+        return {
+            'coef':self.model.coef_,
+            'intercept':self.model.intercept_,
+            'classes':self.model.classes_,
+            'scaler_min':self.scaler.min_,
+            'scaler_scale':self.scaler.scale_,
+            'scaler_data_min':self.scaler.data_min_,
+            'scaler_data_max':self.scaler.data_max_
+        }
+
+    def restore(self,arrays):
+        """
+        Function to restore a model from coefficients stored in a snapshot, without unpickling it
+        """
+        self.model = LogisticRegression()
+        self.model.coef_ = np.array(arrays['coef'])
+        self.model.intercept_ = np.array(arrays['intercept'])
+        self.model.classes_ = np.array(arrays['classes'])
+        self.model.n_features_in_ = self.model.coef_.shape[1]
+        self.scaler = MinMaxScaler(feature_range=(-1, 1))
+        self.scaler.min_ = np.array(arrays['scaler_min'])
+        self.scaler.scale_ = np.array(arrays['scaler_scale'])
+        self.scaler.data_min_ = np.array(arrays['scaler_data_min'])
+        self.scaler.data_max_ = np.array(arrays['scaler_data_max'])
+        self.scaler.data_range_ = self.scaler.data_max_ - self.scaler.data_min_
+        self.scaler.n_features_in_ = len(self.scaler.scale_)
+        self.scaler.n_samples_seen_ = 0
+
     def apply_model(self,vector):
         """
         Function to apply trained model to new question similarity vector
@@ -90,3 +123,22 @@ class Ensemble:
         clfscore = self.model.decision_function([vector])[0]
         pred_label = self.model.predict([vector])[0]
         return [clfscore, pred_label]
+
+    def apply_model_batch(self,vectors):
+        """
+        Function to apply trained model to a matrix of question similarity vectors at once
+        The vectors are scaled and scored in one call; the labels are derived from the scores as the model's predict function would
+        Vectors that cannot be scored (containing nan or infinite values) are given a score of 0.0 and label 0
+        """
+        vectors = np.asarray(vectors,dtype=np.float64)
+        output = [[0.0,0] for vector in vectors]
+        valid = np.flatnonzero(np.isfinite(vectors).all(axis=1)) if len(vectors) > 0 else []
+        if len(valid) > 0:
+            clfscores = self.model.decision_function(self.scale(vectors[valid]))
+            if clfscores.ndim == 1:
+                pred_labels = self.model.classes_[(clfscores > 0).astype(int)]
+            else:
+                pred_labels = self.model.classes_[clfscores.argmax(axis=1)]
+            for i,clfscore,pred_label in zip(valid,clfscores,pred_labels):
+                output[i] = [clfscore,pred_label]
+        return output
@@ -0,0 +1,47 @@
+
+import numpy as np
+
+class GrowableArray:
+    """
+    class to store a one-dimensional numpy array that grows by appending values
+    Capacity is doubled when it runs out, so appending is amortized constant time;
+    a reallocation never changes the array handed out earlier by values(), so earlier views stay valid
+    """
+
+    def __init__(self,dtype,values=(),capacity=1024):
+        self.dtype = dtype
+        self.size = 0
+        self.data = np.empty(max(capacity,len(values)),dtype=dtype)
+        self.extend(values)
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self,size):
+        # make sure the array can hold the given number of values
+        if size > len(self.data):
+            data = np.empty(max(size,2*len(self.data)),dtype=self.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+
+    def attach(self,array):
+        # store the given array (for example a read-only memory map) without copying it; it is copied on the first append
+        self.data = array
+        self.size = len(array)
+
+    def append(self,value):
+        self.reserve(self.size+1)
+        self.data[self.size] = value
+        self.size += 1
+
+    def extend(self,values):
+        values = np.asarray(values,dtype=self.dtype)
+        if len(values) == 0:
+            return
+        self.reserve(self.size+len(values))
+        self.data[self.size:self.size+len(values)] = values
+        self.size += len(values)
+
+    def values(self):
+        # return the stored values as a numpy array (a view, not a copy)
+        return self.data[:self.size]
@@ -1,25 +1,577 @@
 
-import pickle as p
+import copy
+import math
+import bisect
+import numpy as np
+from scipy import sparse
 
-from gensim.summarization import bm25
+from qrel.classes import growable, snapshot
+
+PARAM_K1 = 1.5
+PARAM_B = 0.75
+EPSILON = 0.25
+
+class BM25Statistics:
+    """
+    Corpus statistics shared by the BM25 indices below: corpus size, document lengths and document frequencies
+    Scores are identical to those of the gensim implementation (https://radimrehurek.com/gensim/summarization/bm25.html),
+        but all statistics are updated per added document, so that the index never needs to be rebuilt
+    """
+
+    def __init__(self,k1=PARAM_K1,b=PARAM_B,epsilon=EPSILON):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.corpus_size = 0
+        self.total_len = 0
+        self.avgdl = 0
+        self.vocab_size = 0
+        self.nd_hist = {} # number of documents -> number of words occurring in that many documents
+        self.average_idf_cache = False
+
+    def count_document(self,length):
+        # update the statistics for a new document of the given length
+        self.corpus_size += 1
+        self.total_len += length
+        self.avgdl = float(self.total_len) / self.corpus_size
+        self.average_idf_cache = False
+
+    def count_word(self,n):
+        # update the statistics for a word that occurred in n documents, and now occurs in one more
+        if n > 0:
+            self.nd_hist[n] -= 1
+            if self.nd_hist[n] == 0:
+                del self.nd_hist[n]
+        else:
+            self.vocab_size += 1
+        self.nd_hist[n+1] = self.nd_hist.get(n+1,0) + 1
+
+    def raw_idf(self,n):
+        # idf of a word that occurs in n documents
+        return math.log(self.corpus_size - n + 0.5) - math.log(n + 0.5)
+
+    def average_idf(self):
+        """
+        The average idf over all words, computed from the histogram of document frequencies
+        rather than per word; the value is cached until a new document is added
+        """
+        if self.average_idf_cache is False:
+            idf_sum = sum([count * self.raw_idf(n) for n,count in self.nd_hist.items()])
+            self.average_idf_cache = float(idf_sum) / self.vocab_size if self.vocab_size else 0.0
+        return self.average_idf_cache
+
+    def idf_from_count(self,n):
+        # negative idf values are replaced by a fraction of the average idf, as in the gensim implementation
+        idf = self.raw_idf(n)
+        if idf < 0:
+            idf = self.epsilon * self.average_idf()
+        return idf
+
+class IncrementalBM25(BM25Statistics):
+    """
+    BM25 index that stores a dictionary with word frequencies per document, and scores documents one by one
+    Read-only versions of the index (see freeze) share the document frequencies (nd) with it; while they are shared,
+        the frequencies that change are kept in a small dictionary on top of them (nd_changes),
+        which is merged into a new copy of nd once it holds more than max_changes of all words
+    """
+
+    def __init__(self,corpus=(),k1=PARAM_K1,b=PARAM_B,epsilon=EPSILON,max_changes=0.01):
+        BM25Statistics.__init__(self,k1,b,epsilon)
+        self.max_changes = max_changes
+        self.doc_freqs = [] # per document a dictionary with word frequencies
+        self.doc_len = []
+        self.nd = {} # word -> number of documents containing the word
+        self.nd_changes = {} # word -> number of documents containing the word, for words that changed while nd is shared
+        self.nd_shared = False
+        for document in corpus:
+            self.add_document(document)
+
+    def add_document(self,document):
+        """
+        Function to add a document (list of word tokens) to the index
+        Only the statistics of the words in the document are touched;
+        the idf values of all other words follow from the updated corpus size when they are requested
+        """
+        frequencies = {}
+        for word in document:
+            if word not in frequencies:
+                frequencies[word] = 0
+            frequencies[word] += 1
+        self.doc_freqs.append(frequencies)
+        self.doc_len.append(len(document))
+        self.count_document(len(document))
+        nd = self.nd_changes if self.nd_shared else self.nd
+        for word in frequencies:
+            n = self.document_frequency(word)
+            self.count_word(n)
+            nd[word] = n + 1
+        if len(self.nd_changes) > self.max_changes * self.vocab_size:
+            self.merge_changes()
+        return self.corpus_size - 1
+
+    def document_frequency(self,word):
+        n = self.nd_changes.get(word)
+        return self.nd.get(word,0) if n is None else n
+
+    def merge_changes(self):
+        # merge the changed document frequencies into a new copy of nd, which is no longer shared
+        if self.nd_changes:
+            self.nd = dict(self.nd)
+            self.nd.update(self.nd_changes)
+            self.nd_changes = {}
+        self.nd_shared = False
+
+    def idf(self,word):
+        return self.idf_from_count(self.document_frequency(word))
+
+    def get_score(self,document,index):
+        score = 0.0
+        doc_freqs = self.doc_freqs[index]
+        numerator_constant = self.k1 + 1
+        denominator_constant = self.k1 * (1 - self.b + self.b * self.doc_len[index] / self.avgdl)
+        for word in document:
+            if word in doc_freqs:
+                df = doc_freqs[word]
+                score += (self.idf(word) * df * numerator_constant) / (df + denominator_constant)
+        return score
+
+    def get_scores(self,document):
+        return [self.get_score(document,index) for index in range(self.corpus_size)]
+
+    def get_batch_scores(self,document,indices):
+        return np.array([self.get_score(document,index) for index in indices])
+
+    def get_top(self,document,n):
+        scores = [[i,score] for i,score in enumerate(self.get_scores(document))]
+        return sorted(scores,key = lambda k : k[1],reverse=True)[:n]
+
+    def get_top_batch(self,documents,n):
+        return [self.get_top(document,n) for document in documents]
+
+    def freeze(self):
+        """
+        Function to return a read-only version of the index with the documents added so far,
+            which shares the frequencies per document and the document frequencies with the index
+        Only the document frequencies changed since they were last merged (nd_changes) and the histogram of document frequencies
+            are copied, rather than the document frequencies of all words
+        """
+        self.average_idf()
+        version = copy.copy(self)
+        version.nd_changes = dict(self.nd_changes)
+        version.nd_hist = dict(self.nd_hist)
+        self.nd_shared = True
+        return version
+
+class SparseBM25(BM25Statistics):
+    """
+    BM25 index backed by an inverted index of postings arrays,
+    so that scoring a query only touches the documents that contain one of its words
+    The postings are stored in a compressed sparse row (CSR) term-document matrix;
+    postings of documents added after the matrix was built are kept in a small delta that is merged into the matrix
+    once it grows too large
+    Read-only versions of the index (see freeze) share all postings and the document frequencies (nd) with it;
+        while nd is shared with a version or a snapshot, the frequencies that change (and those of new terms) are kept
+        in a small dictionary on top of it (nd_changes), which is merged into a new copy of nd once it holds more than
+        max_changes of all terms
+    """
+
+    def __init__(self,corpus=(),k1=PARAM_K1,b=PARAM_B,epsilon=EPSILON,max_delta=0.1,max_changes=0.01):
+        BM25Statistics.__init__(self,k1,b,epsilon)
+        self.max_delta = max_delta # fraction of postings in the delta at which it is merged into the matrix
+        self.max_changes = max_changes # fraction of terms with a changed document frequency at which the changes are merged into nd
+        self.term2id = {}
+        self.nterms = 0 # the number of terms known to this version of the index
+        self.nd = growable.GrowableArray(np.int64) # term id -> number of documents containing the term
+        self.nd_changes = {} # term id -> number of documents containing the term, for terms that changed while nd is shared
+        self.nd_shared = False # whether nd is shared, and should not be changed
+        self.doc_len = growable.GrowableArray(np.float64)
+        # CSR matrix: postings of term t are at positions indptr[t]:indptr[t+1] of docids and tfs
+        self.indptr = np.zeros(1,dtype=np.int64)
+        self.docids = np.zeros(0,dtype=np.int32)
+        self.tfs = np.zeros(0,dtype=np.int32)
+        self.base_size = 0 # the number of documents in the CSR matrix
+        self.delta = {} # term id -> ([docids],[tfs]) for documents added after the CSR matrix was built
+        self.delta_postings = 0
+        for document in corpus:
+            self.add_document(document,compact=False)
+        self.compact()
+
+    def add_document(self,document,compact=True):
+        """
+        Function to add a document (list of word tokens) to the index, by appending its postings to the delta
+        """
+        index = self.corpus_size
+        frequencies = {}
+        for word in document:
+            if word not in frequencies:
+                frequencies[word] = 0
+            frequencies[word] += 1
+        self.doc_len.append(len(document))
+        self.count_document(len(document))
+        for word,tf in frequencies.items():
+            if word not in self.term2id:
+                self.term2id[word] = self.nterms
+                self.nterms += 1
+                if self.nd_shared:
+                    self.nd_changes[self.term2id[word]] = 0
+                else:
+                    self.nd.append(0)
+            t = self.term2id[word]
+            n = self.document_frequency(t)
+            self.count_word(n)
+            if self.nd_shared:
+                self.nd_changes[t] = n + 1
+            else:
+                self.nd.values()[t] = n + 1
+            if t not in self.delta:
+                self.delta[t] = ([],[])
+            self.delta[t][0].append(index)
+            self.delta[t][1].append(tf)
+        self.delta_postings += len(frequencies)
+        if len(self.nd_changes) > self.max_changes * self.nterms:
+            self.merge_changes()
+        if compact and self.delta_postings > self.max_delta * len(self.docids):
+            self.compact()
+        return index
+
+    def document_frequency(self,t):
+        # return the number of documents that contain the term with id t
+        n = self.nd_changes.get(t)
+        return int(self.nd.values()[t]) if n is None else n
+
+    def merge_changes(self):
+        """
+        Function to merge the changed document frequencies into a new copy of nd, which is no longer shared
+        This copies the document frequencies of all terms, but only once max_changes of the terms have changed
+        """
+        if self.nd_changes or len(self.nd) < self.nterms:
+            nd = growable.GrowableArray(np.int64,self.nd.values(),capacity=self.nterms)
+            nd.extend(np.zeros(self.nterms-len(nd),dtype=np.int64))
+            values = nd.values()
+            for t,n in self.nd_changes.items():
+                values[t] = n
+            self.nd = nd
+            self.nd_changes = {}
+        self.nd_shared = False
+
+    def compact(self):
+        """
+        Function to merge the postings in the delta into the CSR matrix
+        Postings of each term remain sorted by document index, as documents in the delta were added after those in the matrix
+        """
+        if not self.delta:
+            self.base_size = self.corpus_size
+            return
+        nterms = self.nterms
+        base_counts = np.zeros(nterms,dtype=np.int64)
+        base_counts[:len(self.indptr)-1] = np.diff(self.indptr)
+        delta_counts = np.zeros(nterms,dtype=np.int64)
+        for t,postings in self.delta.items():
+            delta_counts[t] = len(postings[0])
+        indptr = np.zeros(nterms+1,dtype=np.int64)
+        np.cumsum(base_counts+delta_counts,out=indptr[1:])
+        docids = np.empty(indptr[-1],dtype=np.int32)
+        tfs = np.empty(indptr[-1],dtype=np.int32)
+        # move the postings in the matrix to their new position
+        terms = np.repeat(np.arange(nterms),base_counts)
+        positions = np.arange(len(self.docids)) - self.indptr[terms] + indptr[terms]
+        docids[positions] = self.docids
+        tfs[positions] = self.tfs
+        # append the postings in the delta
+        for t,postings in self.delta.items():
+            start = indptr[t] + base_counts[t]
+            docids[start:start+delta_counts[t]] = postings[0]
+            tfs[start:start+delta_counts[t]] = postings[1]
+        self.indptr, self.docids, self.tfs = indptr, docids, tfs
+        self.base_size = self.corpus_size
+        self.delta = {}
+        self.delta_postings = 0
+
+    def export(self):
+        # return the index as a dictionary of arrays (after merging the delta into the CSR matrix), to store it in a snapshot
+        self.compact()
+        self.merge_changes()
+        terms, term_offsets = snapshot.encode_strings(sorted(self.term2id,key = lambda k : self.term2id[k]))
+        return {'indptr':self.indptr,'docids':self.docids,'tfs':self.tfs,'nd':self.nd.values(),
+            'doc_len':self.doc_len.values(),'terms':terms,'term_offsets':term_offsets}
+
+    def restore(self,arrays):
+        """
+        Function to restore an index exported to a snapshot
+        The postings arrays are used as they are (without copying them), the statistics are recomputed from the document lengths 
+            and frequencies
+        """
+        self.term2id = dict([(w,t) for t,w in enumerate(snapshot.decode_strings(arrays['terms'],arrays['term_offsets']))])
+        self.nd = growable.GrowableArray(np.int64)
+        self.nd.attach(arrays['nd'])
+        self.nd_changes = {}
+        self.nd_shared = True # the stored array is read-only
+        self.nterms = len(self.nd)
+        self.doc_len.attach(arrays['doc_len'])
+        self.indptr, self.docids, self.tfs = arrays['indptr'], arrays['docids'], arrays['tfs']
+        self.corpus_size = len(self.doc_len)
+        self.total_len = int(self.doc_len.values().sum())
+        self.avgdl = float(self.total_len) / self.corpus_size if self.corpus_size else 0
+        self.vocab_size = len(self.nd)
+        self.nd_hist = {}
+        for n in self.nd.values().tolist():
+            self.nd_hist[n] = self.nd_hist.get(n,0) + 1
+        self.average_idf_cache = False
+        self.base_size = self.corpus_size
+        self.delta = {}
+        self.delta_postings = 0
+
+    def freeze(self):
+        """
+        Function to return a read-only version of the index with the documents added so far (copy-on-write),
+            which keeps scoring documents in the same way while documents are added to the index
+        The version shares the postings arrays, the delta and the term ids with the index, as these only grow:
+            postings of documents added after the version was made are skipped, and so are terms that are new since;
+            the CSR matrix and the delta are replaced (rather than changed) when the delta is merged
+        The document frequencies are shared as well; only those changed since they were last merged (nd_changes) are copied
+        """
+        self.average_idf()
+        version = copy.copy(self)
+        version.doc_len = growable.GrowableArray(np.float64)
+        version.doc_len.attach(self.doc_len.values())
+        version.nd_changes = dict(self.nd_changes)
+        self.nd_shared = True
+        return version
+
+    def postings(self,t):
+        # return the document indices and term frequencies of all documents that contain the term with id t
+        if t < len(self.indptr) - 1:
+            docids = self.docids[self.indptr[t]:self.indptr[t+1]]
+            tfs = self.tfs[self.indptr[t]:self.indptr[t+1]]
+        else:
+            docids = self.docids[:0]
+            tfs = self.tfs[:0]
+        if t in self.delta:
+            delta_docids, delta_tfs = self.delta[t]
+            n = bisect.bisect_left(delta_docids,self.corpus_size) # skip documents added after this version of the index
+            docids = np.concatenate([docids,np.asarray(delta_docids[:n],dtype=np.int32)])
+            tfs = np.concatenate([tfs,np.asarray(delta_tfs[:n],dtype=np.int32)])
+        return docids, tfs
+
+    def term_frequency(self,t,index):
+        # return the frequency of the term with id t in the document with the given index
+        if index < self.base_size:
+            if t >= len(self.indptr) - 1:
+                return 0
+            start, end = self.indptr[t], self.indptr[t+1]
+            i = start + np.searchsorted(self.docids[start:end],index)
+            return self.tfs[i] if i < end and self.docids[i] == index else 0
+        elif t in self.delta:
+            docids = self.delta[t][0]
+            i = bisect.bisect_left(docids,index)
+            return self.delta[t][1][i] if i < len(docids) and docids[i] == index else 0
+        return 0
+
+    def query_terms(self,document):
+        # return the term ids in the given document that are known to the index, and how often each of them occurs
+        counts = {}
+        nterms = self.nterms
+        for word in document:
+            t = self.term2id.get(word,nterms)
+            if t < nterms: # terms added after this version of the index are unknown
+                counts[t] = counts.get(t,0) + 1
+        return counts
+
+    def idf(self,word):
+        return self.idf_from_count(self.document_frequency(self.term2id[word]))
+
+    def match(self,document):
+        """
+        Function to score all documents that contain at least one word of the given document
+        returns the indices of these documents (in ascending order) and their BM25 scores
+        """
+        counts = self.query_terms(document)
+        if len(counts) == 0:
+            return np.zeros(0,dtype=np.int64), np.zeros(0)
+        docids, tfs, weights = [], [], []
+        for t,count in counts.items():
+            t_docids, t_tfs = self.postings(t)
+            docids.append(t_docids)
+            tfs.append(t_tfs)
+            weights.append(np.full(len(t_docids),count * self.idf_from_count(self.document_frequency(t))))
+        docids = np.concatenate(docids)
+        tfs = np.concatenate(tfs).astype(np.float64)
+        weights = np.concatenate(weights)
+        denominator = tfs + self.k1 * (1 - self.b + self.b * self.doc_len.values()[docids] / self.avgdl)
+        contributions = weights * tfs * (self.k1 + 1) / denominator
+        matched, inverse = np.unique(docids,return_inverse=True)
+        return matched, np.bincount(inverse,weights=contributions,minlength=len(matched))
+
+    def match_batch(self,documents):
+        """
+        Function to score all indexed documents that contain at least one word of each of the given documents, in one pass
+        The postings of each term are read once for all given documents: a matrix with the weight (count * idf) of each term
+            in each given document is multiplied with a sparse term-document matrix with the contribution of each posting
+        returns a sparse (CSR) matrix with a row of scores for each given document, of which only the matched documents are stored
+        """
+        counts = [self.query_terms(document) for document in documents]
+        terms = sorted(set([t for c in counts for t in c]))
+        columns = dict([(t,i) for i,t in enumerate(terms)])
+        rows = [i for i,c in enumerate(counts) for t in c]
+        cols = [columns[t] for c in counts for t in c]
+        weights = [count * self.idf_from_count(self.document_frequency(t)) for c in counts for t,count in c.items()]
+        queries = sparse.csr_matrix((weights,(rows,cols)),shape=(len(documents),len(terms)))
+        indptr, docids, tfs = [0], [np.zeros(0,dtype=np.int32)], [np.zeros(0,dtype=np.int32)]
+        for t in terms:
+            t_docids, t_tfs = self.postings(t)
+            docids.append(t_docids)
+            tfs.append(t_tfs)
+            indptr.append(indptr[-1] + len(t_docids))
+        docids = np.concatenate(docids)
+        tfs = np.concatenate(tfs).astype(np.float64)
+        denominator = tfs + self.k1 * (1 - self.b + self.b * self.doc_len.values()[docids] / self.avgdl)
+        postings = sparse.csr_matrix((tfs * (self.k1 + 1) / denominator,docids,indptr),shape=(len(terms),self.corpus_size))
+        scores = queries.dot(postings).tocsr()
+        scores.sort_indices()
+        return scores
+
+    def get_score(self,document,index):
+        score = 0.0
+        numerator_constant = self.k1 + 1
+        denominator_constant = self.k1 * (1 - self.b + self.b * self.doc_len.values()[index] / self.avgdl)
+        for t,count in self.query_terms(document).items():
+            df = self.term_frequency(t,index)
+            if df > 0:
+                score += count * (self.idf_from_count(self.document_frequency(t)) * df * numerator_constant) / (df + denominator_constant)
+        return score
+
+    def get_scores(self,document):
+        scores = np.zeros(self.corpus_size)
+        matched, matched_scores = self.match(document)
+        scores[matched] = matched_scores
+        return scores
+
+    def get_batch_scores(self,document,indices):
+        # return the scores of the documents with the given indices, from a single pass over the postings
+        indices = np.asarray(indices,dtype=np.int64)
+        scores = np.zeros(len(indices))
+        matched, matched_scores = self.match(document)
+        if len(matched) > 0 and len(indices) > 0:
+            positions = np.minimum(np.searchsorted(matched,indices),len(matched)-1)
+            found = matched[positions] == indices
+            scores[found] = matched_scores[positions[found]]
+        return scores
+
+    def get_top(self,document,n):
+        """
+        Function to return the n highest scoring documents for a given document, as a list of [index, score]
+        The ranking is the same as that of sorting the scores of all documents (ties are ranked by index),
+        but only the matched documents are scored, and the top n are found by partial selection
+        Documents that do not contain any word of the given document have a score of 0,
+        and only fill up the ranking if less than n documents have a positive score
+        """
+        n = min(n,self.corpus_size)
+        if n <= 0:
+            return []
+        matched, scores = self.match(document)
+        return self.rank(matched,scores,n)
+
+    def get_top_batch(self,documents,n):
+        """
+        Function to return the n highest scoring documents for each of the given documents, ranked as by get_top,
+            of which the scores are computed in one pass over the postings of all their words (see match_batch)
+        """
+        n = min(n,self.corpus_size)
+        if n <= 0:
+            return [[] for document in documents]
+        scores = self.match_batch(documents)
+        return [self.rank(scores.indices[start:end].astype(np.int64),scores.data[start:end],n) for start,end in zip(scores.indptr[:-1],scores.indptr[1:])]
+
+    def rank(self,matched,scores,n):
+        # rank the n highest scoring documents, given the indices and scores of the matched documents
+        positive = scores > 0
+        top = self.select_top(matched[positive],scores[positive],n)
+        if len(top) < n: # fill up with the first documents that score 0
+            negative = [[i,score] for i,score in zip(matched[scores < 0].tolist(),scores[scores < 0].tolist())]
+            skip = set(matched[positive].tolist()) | set([i for i,score in negative])
+            for i in range(self.corpus_size):
+                if len(top) == n:
+                    break
+                if i not in skip:
+                    top.append([i,0.0])
+            if len(top) < n:
+                top.extend(sorted(negative,key = lambda k : k[1],reverse=True)[:n-len(top)])
+        return top
+
+    def select_top(self,docids,scores,n):
+        # select the n highest scores with argpartition, ties at the cutoff are resolved by document index
+        if len(scores) > n:
+            kth = -np.partition(-scores,n-1)[n-1]
+            above = scores > kth
+            ties = np.flatnonzero(scores == kth)[:n-int(above.sum())]
+            selection = np.concatenate([np.flatnonzero(above),ties])
+            docids, scores = docids[selection], scores[selection]
+        order = np.lexsort((docids,-scores))
+        return [[i,score] for i,score in zip(docids[order].tolist(),scores[order].tolist())]
 
 class GV_BM25:
     """
-    class to train and apply BM25 to score the similarity between any two strings based on tfidf values of word tokens 
+    class to train and apply BM25 to score the similarity between any two strings based on tfidf values of word tokens
     returns a similarity score
     """
 
     def __init__(self):
         self.model = False
 
-    def init_model(self,questions):
-        # initialize BM25 model by reading in questions; the gensim implementation of BM25 is used (https://radimrehurek.com/gensim/summarization/bm25.html)
-        self.model = bm25.BM25(questions)
-    
+    def init_model(self,questions,backend='sparse'):
+        """
+        initialize BM25 model by reading in questions; scoring follows the gensim implementation of BM25 (https://radimrehurek.com/gensim/summarization/bm25.html)
+        Two backends are available: 'sparse' (inverted index, scales with the number of matching questions)
+            and 'dict' (a dictionary of word frequencies per question, scores every question); only the sparse model can be stored in a snapshot
+        """
+        if backend == 'sparse':
+            self.model = SparseBM25(questions)
+        elif backend == 'dict':
+            self.model = IncrementalBM25(questions)
+        else:
+            raise ValueError('Unknown BM25 backend ' + str(backend) + ', choose from \'sparse\' and \'dict\'')
+
+    def export(self):
+        # return the arrays of the sparse model, to store them in a snapshot
+        if not isinstance(self.model,SparseBM25):
+            raise ValueError('Only the sparse BM25 backend can be stored in a snapshot, this model uses the dict backend')
+        return self.model.export()
+
+    def restore(self,arrays):
+        # restore the sparse model from arrays stored in a snapshot
+        self.model = SparseBM25()
+        self.model.restore(arrays)
+
+    def freeze(self):
+        # return a read-only version of the model with the questions added so far, which does not change when questions are added
+        version = GV_BM25()
+        version.model = self.model.freeze()
+        return version
+
+    def add_question(self,questiontokens):
+        # add a question to the model without retraining it, returns the index of the question in the model
+        return self.model.add_document(questiontokens)
+
+    def size(self):
+        # return the number of questions in the model
+        return self.model.corpus_size
+
     def return_scores(self,questiontokens):
         # return BM25 scores for all questions in the model, given the word tokens in a given question
         return self.model.get_scores(questiontokens)
 
+    def return_top(self,questiontokens,n):
+        # return the indices and BM25 scores of the n highest scoring questions in the model, given the word tokens in a given question
+        return self.model.get_top(questiontokens,n)
+
+    def return_top_batch(self,questiontokens,n):
+        # return the indices and BM25 scores of the n highest scoring questions in the model for each of a list of questions (word tokens)
+        return self.model.get_top_batch(questiontokens,n)
+
+    def return_score_batch(self,q1,q2_indices):
+        # return BM25 scores for a list of question indices in the model, given a new question
+        return self.model.get_batch_scores(q1.tokens,q2_indices)
+
     def return_score(self,q1,q2_idx):
         # return BM25 score for a particular question index in the model, given a new question
         return self.model.get_score(q1.tokens,q2_idx)
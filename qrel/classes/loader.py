@@ -0,0 +1,67 @@
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class Loader:
+    """
+    Class to load the components of the system, either in parallel threads or lazily on their first use
+    Each component is loaded only once, also when it is requested by several threads at the same time,
+        and the time it took to load it is recorded
+    """
+
+    def __init__(self,workers=8):
+        self.functions = {} # name of component -> function that loads it
+        self.futures = {} # name of component -> future with the loaded component
+        self.times = {} # name of component -> load time in seconds
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+
+    def register(self,name,function):
+        # register the function to load a component, replacing an earlier registration under the same name
+        with self.lock:
+            self.functions[name] = function
+            if name in self.futures:
+                del self.futures[name]
+
+    def timed(self,name):
+        # return the function to load a component, wrapped to record its load time
+        function = self.functions[name]
+        def load():
+            start = time.time()
+            component = function()
+            self.times[name] = time.time() - start
+            print('Loaded',name,'in',round(self.times[name],2),'seconds')
+            return component
+        return load
+
+    def start(self,names):
+        # start loading the given components in parallel threads
+        with self.lock:
+            for name in names:
+                if name not in self.futures:
+                    self.futures[name] = self.pool.submit(self.timed(name))
+
+    def get(self,name):
+        """
+        Function to return a loaded component, waiting for it if it is being loaded
+        A component that was not started yet is loaded on the spot (lazy loading)
+        """
+        with self.lock:
+            if name not in self.futures:
+                future = self.futures[name] = self.pool.submit(self.timed(name))
+            else:
+                future = self.futures[name]
+        return future.result()
+
+    def wait(self,names):
+        # wait for the given components to be loaded
+        for name in names:
+            self.get(name)
+
+    def loaded(self,name):
+        return name in self.futures and self.futures[name].done()
+
+    def report(self):
+        # print the load time of each loaded component
+        print('Load times (seconds):',', '.join([name + ' ' + str(round(t,2)) for name,t in sorted(self.times.items(),key = lambda k : k[1],reverse=True)]))
@@ -0,0 +1,136 @@
+
+import numpy as np
+
+from qrel.classes import snapshot
+
+class NgramMatcher:
+    """
+    Class to find all occurrences of a set of n-grams (strings of space-separated tokens) in a sequence of tokens,
+    with an Aho-Corasick automaton over the tokens of the n-grams
+    The automaton is a trie stored in arrays: the children of node i are at positions indptr[i]:indptr[i+1] of labels (token ids,
+        in ascending order) and targets; each node has a failure link to the node of its longest proper suffix in the trie,
+        and an output link to the nearest node on its failure chain that completes an n-gram
+    A sequence is scanned in a single pass, without restarting at each position
+    The tokens (in sorted order, their position is their id) and the n-grams are stored in string tables,
+        so that an automaton opened from a memory map is used without decoding them
+    """
+
+    def __init__(self,ngrams=()):
+        self.ngrams = snapshot.StringTable(*snapshot.encode_strings([])) # the n-grams, in sorted order of their tokens
+        self.tokens = snapshot.StringTable(*snapshot.encode_strings([]))
+        self.indptr = np.zeros(2,dtype=np.int64)
+        self.labels = np.zeros(0,dtype=np.int32)
+        self.targets = np.zeros(0,dtype=np.int32)
+        self.fail = np.zeros(1,dtype=np.int32)
+        self.outlink = np.full(1,-1,dtype=np.int32)
+        self.output = np.full(1,-1,dtype=np.int32) # node -> index of the n-gram that ends in it, or -1
+        self.depth = np.zeros(1,dtype=np.int32)
+        if len(ngrams) > 0:
+            self.build(ngrams)
+
+    def __len__(self):
+        return len(self.ngrams)
+
+    def build(self,ngrams):
+        """
+        Function to build the automaton for the given n-grams
+        The trie is built in one pass over the n-grams sorted by their token ids, which visits its nodes depth-first;
+            the failure links are then set breadth-first
+        """
+        ngrams = [ngram for ngram in set(ngrams) if len(ngram.split()) > 0]
+        vocabulary = sorted(set([token for ngram in ngrams for token in ngram.split()]))
+        token2id = dict([(token,i) for i,token in enumerate(vocabulary)])
+        sequences = dict([(tuple([token2id[token] for token in ngram.split()]),ngram) for ngram in ngrams])
+        ordered = sorted(sequences)
+        self.tokens = snapshot.StringTable(*snapshot.encode_strings(vocabulary))
+        self.ngrams = snapshot.StringTable(*snapshot.encode_strings([sequences[sequence] for sequence in ordered]))
+        parent, label, output, depth = [-1], [-1], [-1], [0]
+        path = [0] # nodes on the path from the root to the node of the previous sequence
+        previous = ()
+        for i,sequence in enumerate(ordered):
+            shared = 0
+            while shared < min(len(sequence),len(previous)) and sequence[shared] == previous[shared]:
+                shared += 1
+            del path[shared+1:]
+            for token in sequence[shared:]:
+                parent.append(path[-1])
+                label.append(token)
+                output.append(-1)
+                depth.append(len(path))
+                path.append(len(parent)-1)
+            output[path[-1]] = i
+            previous = sequence
+        nnodes = len(parent)
+        parent = np.array(parent,dtype=np.int64)
+        label = np.array(label,dtype=np.int32)
+        # children of each node, in ascending order of their label as the nodes were created in sorted order
+        children = np.argsort(parent[1:],kind='stable') + 1
+        self.indptr = np.zeros(nnodes+1,dtype=np.int64)
+        np.cumsum(np.bincount(parent[1:],minlength=nnodes),out=self.indptr[1:])
+        self.labels = label[children]
+        self.targets = children.astype(np.int32)
+        self.output = np.array(output,dtype=np.int32)
+        self.depth = np.array(depth,dtype=np.int32)
+        self.fail = np.zeros(nnodes,dtype=np.int32)
+        self.outlink = np.full(nnodes,-1,dtype=np.int32)
+        for node in np.argsort(self.depth,kind='stable').tolist()[1:]: # breadth-first, so that the links of the parent are set
+            f = int(self.fail[parent[node]])
+            child = -1
+            if parent[node] != 0:
+                while True:
+                    child = self.child(f,int(label[node]))
+                    if child >= 0 or f == 0:
+                        break
+                    f = int(self.fail[f])
+            self.fail[node] = child if child >= 0 else 0
+            f = self.fail[node]
+            self.outlink[node] = f if self.output[f] >= 0 else self.outlink[f]
+
+    def child(self,node,token):
+        # return the child of a node with the given token as its label, or -1
+        start, end = self.indptr[node], self.indptr[node+1]
+        i = start + np.searchsorted(self.labels[start:end],token)
+        return int(self.targets[i]) if i < end and self.labels[i] == token else -1
+
+    def match(self,tokens,token_ids=False):
+        """
+        Function to find all n-grams that occur in a sequence of tokens
+        The ids of tokens are looked up in the string table, and stored in token_ids (a dictionary) if it is given
+        returns a list of [index of the n-gram, start, end] for each occurrence, where tokens[start:end] is the n-gram,
+            ordered by end position (and from long to short n-grams for the same end position)
+        """
+        matches = []
+        node = 0
+        for position,token in enumerate(tokens):
+            if token_ids is not False:
+                if token not in token_ids:
+                    token_ids[token] = self.tokens.index(token)
+                t = token_ids[token]
+            else:
+                t = self.tokens.index(token)
+            if t < 0:
+                node = 0
+                continue
+            while True:
+                child = self.child(node,t)
+                if child >= 0 or node == 0:
+                    break
+                node = int(self.fail[node])
+            node = child if child >= 0 else 0
+            n = node if self.output[node] >= 0 else int(self.outlink[node])
+            while n > 0:
+                matches.append([int(self.output[n]),position+1-int(self.depth[n]),position+1])
+                n = int(self.outlink[n])
+        return matches
+
+    def export(self):
+        # return the automaton as a dictionary of arrays, to store it in a file
+        return {'ngrams':self.ngrams.blob,'ngram_offsets':self.ngrams.offsets,'tokens':self.tokens.blob,'token_offsets':self.tokens.offsets,'indptr':self.indptr,
+            'labels':self.labels,'targets':self.targets,'fail':self.fail,'outlink':self.outlink,'output':self.output,'depth':self.depth}
+
+    def restore(self,arrays):
+        # restore an automaton stored in a file, without copying its arrays
+        self.ngrams = snapshot.StringTable(arrays['ngrams'],arrays['ngram_offsets'])
+        self.tokens = snapshot.StringTable(arrays['tokens'],arrays['token_offsets'])
+        for name in ['indptr','labels','targets','fail','outlink','output','depth']:
+            setattr(self,name,arrays[name])
@@ -1,8 +1,57 @@
 
+import threading
+from array import array
+
+class Vocabulary:
+    """
+    Class to intern strings as integer ids, shared by all questions
+    A sequence of strings is stored as a compact array of ids, rather than a list of (references to) strings
+    """
+
+    def __init__(self):
+        self.string2id = {}
+        self.strings = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.strings)
+
+    def add(self,string):
+        # give a new string the next id
+        with self.lock:
+            if string not in self.string2id:
+                self.strings.append(string)
+                self.string2id[string] = len(self.strings) - 1
+            return self.string2id[string]
+
+    def encode(self,strings):
+        # return the ids of the given strings as an array, or None if no strings are given (False)
+        if strings is False or strings is None:
+            return None
+        ids = array('i')
+        for string in strings:
+            i = self.string2id.get(string)
+            ids.append(self.add(string) if i is None else i)
+        return ids
+
+    def decode(self,ids):
+        # return the strings of the given ids as a list, or False if no ids are given
+        if ids is None:
+            return False
+        return [self.strings[i] for i in ids]
+
+TOKENS = Vocabulary()
+LEMMAS = Vocabulary()
+TAGS = Vocabulary()
+
 class Question:
     """
     Class to manage all information related to a single question
+    Tokens, lemmas and part-of-speech tags are stored as arrays of ids in vocabularies shared by all questions,
+        and returned as lists of strings; each read decodes a new list (a copy), so changing it does not change the question,
+        and code that reads them repeatedly should keep the list in a variable (or use the ids directly)
     """
+    __slots__ = ('id','questiontext','token_ids','lemma_ids','pos_ids','topics','related','emb')
 
     def __init__(self):
         self.id = False
@@ -14,6 +63,30 @@ class Question:
         self.related = False
         self.emb = [] # not stored in qdict
 
+    @property
+    def tokens(self):
+        return TOKENS.decode(self.token_ids)
+
+    @tokens.setter
+    def tokens(self,tokens):
+        self.token_ids = TOKENS.encode(tokens)
+
+    @property
+    def lemmas(self):
+        return LEMMAS.decode(self.lemma_ids)
+
+    @lemmas.setter
+    def lemmas(self,lemmas):
+        self.lemma_ids = LEMMAS.encode(lemmas)
+
+    @property
+    def pos(self):
+        return TAGS.decode(self.pos_ids)
+
+    @pos.setter
+    def pos(self,pos):
+        self.pos_ids = TAGS.encode(pos)
+
     def import_qdict(self,qdict):
         # function to import json-formatted questions from file
         self.id = qdict['id']
@@ -65,10 +138,25 @@ class Question:
         which is needed for similarity prediction and topic extraction
         The Spacy nl_core_news_sm model is used for this
         """
-        self.tokens, self.lemmas, self.pos = [],[],[]
-        preprocessed = nlp(self.questiontext)
-        for token in preprocessed:
+        self.process_doc(nlp(self.questiontext))
+
+    def process_doc(self,doc):
+        # function to extract tokens, lemmas and part-of-speech tags from the spacy analysis (doc) of the question text
+        tokens, lemmas, pos = [],[],[]
+        for token in doc:
             if not token.pos_ == 'PUNCT':
-                self.tokens.append(token.text.lower())
-                self.lemmas.append(token.lemma_)
-                self.pos.append(token.pos_)
+                tokens.append(token.text.lower())
+                lemmas.append(token.lemma_)
+                pos.append(token.pos_)
+        self.tokens, self.lemmas, self.pos = tokens, lemmas, pos
+
+def preprocess_questions(questions,nlp,batch_size=1000,n_process=1):
+    """
+    Function to preprocess many questions at once, with the same outcome as calling preprocess for each of them
+    The question texts are analyzed in batches of batch_size by nlp.pipe, in n_process processes;
+        each question is yielded once it is preprocessed
+    """
+    docs = nlp.pipe((q.questiontext for q in questions),batch_size=batch_size,n_process=n_process)
+    for q,doc in zip(questions,docs):
+        q.process_doc(doc)
+        yield q
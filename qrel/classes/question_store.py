@@ -0,0 +1,131 @@
+
+import os
+import re
+import json
+
+SEPARATORS = re.compile(r'[\s,]*') # whitespace and commas between the items of a json list
+ENDINGS = set(' \t\n\r,]') # characters that can follow a complete item of a json list
+
+def write_json(path,obj):
+    # write an object to a json file atomically: the file is written under a temporary name and moved in place when complete
+    with open(path + '.tmp','w',encoding='utf-8') as file_out:
+        json.dump(obj,file_out)
+        file_out.flush()
+        os.fsync(file_out.fileno())
+    os.replace(path + '.tmp',path)
+
+def iterate_json(path,chunksize=1048576):
+    """
+    Function to iterate over the items of a json-formatted list in a file, without reading the whole file into memory
+    The file is read in chunks of chunksize characters, from which the items are decoded one by one with json.JSONDecoder.raw_decode
+    A number may be decoded from only the first part of it (12 from 1234, 0 from 0.5) if it continues in the next chunk,
+        so an item is only accepted if it is followed by whitespace, a comma or the end of the list, or the end of the file is reached
+    """
+    decoder = json.JSONDecoder()
+    with open(path,'r',encoding='utf-8') as file_in:
+        buffer = ''
+        while True: # skip leading whitespace, which may span several chunks
+            chunk = file_in.read(chunksize)
+            buffer = chunk.lstrip()
+            if buffer or not chunk:
+                break
+        if not buffer.startswith('['):
+            raise ValueError('File ' + path + ' does not contain a json list')
+        position = 1
+        eof = False
+        while True:
+            position = SEPARATORS.match(buffer,position).end()
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                if position == len(buffer):
+                    raise ValueError('End of buffer')
+                item, end = decoder.raw_decode(buffer,position)
+                if (end == len(buffer) or buffer[end] not in ENDINGS) and not eof:
+                    raise ValueError('Item may continue in the next chunk')
+            except ValueError: # the item continues in the next chunk
+                chunk = file_in.read(chunksize)
+                if not chunk:
+                    if eof or position == len(buffer):
+                        raise ValueError('File ' + path + ' ends in the middle of the json list')
+                    eof = True # decode the last item as it is
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            position = end
+            yield item
+
+class QuestionStore:
+    """
+    Class to persist questions without rewriting all of them on every change
+    Questions are stored in a base file (in the legacy format of questions.json: a json list of question dictionaries)
+        and an append-only log, with one json-formatted question dictionary per line for every question that was added or changed
+        since the base file was written
+    When the log grows too long, it is compacted: the base file is rewritten with all questions and the log is emptied
+    """
+
+    def __init__(self,basepath,logpath,compact_every=10000):
+        self.basepath = basepath
+        self.logpath = logpath
+        self.compact_every = compact_every # number of records in the log after which it is compacted
+        self.records = 0 # number of records in the log
+
+    def load(self):
+        # return the stored questions as a list of question dictionaries
+        return list(self.iterate())
+
+    def iterate(self):
+        """
+        Function to iterate over the stored questions as question dictionaries
+        The records in the log are replayed on top of the base file: a record replaces the question with the same id,
+            or is added after the questions in the base file if its id is new
+        Only the log is read into memory, the base file is streamed
+        """
+        self.records = 0
+        logged = {} # question id -> last record in the log, in the order in which the ids first occur in the log
+        if os.path.exists(self.logpath):
+            with open(self.logpath,'r',encoding='utf-8') as file_in:
+                for line in file_in:
+                    try:
+                        qd = json.loads(line)
+                    except ValueError: # incomplete record at the end of the log, from an interrupted write
+                        continue
+                    self.records += 1
+                    logged[qd['id']] = qd
+        for qd in iterate_json(self.basepath):
+            yield logged.pop(qd['id']) if qd['id'] in logged else qd
+        for qd in logged.values():
+            yield qd
+
+    def append(self,questions):
+        # append the given (added or changed) questions to the log
+        if len(questions) == 0:
+            return
+        with open(self.logpath,'a',encoding='utf-8') as file_out:
+            for q in questions:
+                file_out.write(json.dumps(q.return_qdict()) + '\n')
+            file_out.flush()
+            os.fsync(file_out.fileno())
+        self.records += len(questions)
+
+    def needs_compaction(self):
+        return self.records >= self.compact_every
+
+    def compact(self,questions,related_questionspath):
+        """
+        Function to rewrite the base file with all questions (and export their related questions) and empty the log
+        The base file is replaced atomically before the log is emptied,
+            so that an interruption at any point leaves a store from which all questions can be loaded
+        """
+        self.export(questions,self.basepath,related_questionspath)
+        if os.path.exists(self.logpath):
+            os.remove(self.logpath)
+        self.records = 0
+
+    def export(self,questions,questionspath,related_questionspath):
+        # write the questions to the legacy json files: all fields to questionspath, the related questions only to related_questionspath
+        write_json(questionspath,[q.return_qdict() for q in questions])
+        try:
+            related_questions_json = [q.return_qdict(short=True) for q in questions]
+        except TypeError: # not all questions are related yet
+            return
+        write_json(related_questionspath,related_questions_json)
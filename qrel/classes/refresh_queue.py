@@ -0,0 +1,146 @@
+
+import time
+import heapq
+import threading
+
+class RefreshQueue:
+    """
+    Class to refresh items (such as the related questions of a question) in a background thread
+    Items that need a refresh are marked by their id in a dirty set, so that an item marked several times is refreshed once;
+        they are refreshed in batches, the most stale first (priority='staleness') or the most often marked first (priority='traffic')
+    After each batch the thread sleeps in proportion to the cpu time the batch took,
+        so that it uses at most the given fraction (budget) of one core
+    Ids that fail to refresh are marked again, until they have failed max_failures times in a row; then they are dropped
+    """
+
+    def __init__(self,refresh,batchsize=50,budget=0.25,priority='staleness',interval=1.0,max_failures=3):
+        if budget <= 0:
+            raise ValueError('The refresh budget should be a fraction of a core above 0, got ' + str(budget))
+        self.refresh = refresh # function that refreshes a list of ids, and returns the ids that failed (if any)
+        self.batchsize = batchsize
+        self.budget = budget
+        self.priority = priority
+        self.interval = interval # number of seconds to wait for new items when the dirty set is empty
+        self.max_failures = max_failures
+        self.dirty = {} # id -> [time at which it was first marked, number of times it was marked]
+        self.failures = {} # id -> number of times in a row that refreshing it failed
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.thread = False
+        self.stopped = False
+        self.processed = 0
+        self.batches = 0
+        self.errors = 0
+        self.dropped = 0
+        self.last_batch = 0.0 # duration of the last batch in seconds
+
+    def __len__(self):
+        return len(self.dirty)
+
+    def mark(self,ids):
+        # mark the given ids as in need of a refresh
+        now = time.time()
+        with self.lock:
+            for i in ids:
+                if i in self.dirty:
+                    self.dirty[i][1] += 1
+                else:
+                    self.dirty[i] = [now,1]
+
+    def next_batch(self,size=False):
+        # take the size (by default batchsize) ids with the highest priority from the dirty set
+        with self.lock:
+            if self.priority == 'traffic':
+                key = lambda i : (-self.dirty[i][1],self.dirty[i][0])
+            else:
+                key = lambda i : self.dirty[i][0]
+            batch = heapq.nsmallest(size if size else self.batchsize,self.dirty,key=key)
+            for i in batch:
+                del self.dirty[i]
+        return batch
+
+    def fail(self,ids):
+        # mark the ids that failed to refresh again, or drop those that failed max_failures times
+        retry = []
+        with self.lock:
+            for i in ids:
+                self.failures[i] = self.failures.get(i,0) + 1
+                if self.failures[i] < self.max_failures:
+                    retry.append(i)
+                else:
+                    print('Refreshing',i,'failed',self.failures[i],'times, dropped')
+                    del self.failures[i]
+                    self.dropped += 1
+        self.errors += len(ids)
+        self.mark(retry)
+
+    def process_batch(self):
+        # refresh the next batch, returns the number of refreshed ids
+        batch = self.next_batch()
+        if len(batch) == 0:
+            return 0
+        start = time.time()
+        try:
+            failed = self.refresh(batch)
+        except Exception as e:
+            print('Refreshing',len(batch),'items failed:',e)
+            self.fail(batch)
+            raise
+        finally:
+            self.last_batch = time.time() - start
+        failed = set(failed) if failed else set()
+        if len(failed) > 0:
+            self.fail(failed)
+        if len(self.failures) > 0:
+            with self.lock:
+                for i in batch:
+                    if i not in failed:
+                        self.failures.pop(i,None)
+        self.processed += len(batch) - len(failed)
+        self.batches += 1
+        return len(batch)
+
+    def process(self):
+        # refresh all marked ids in the current thread
+        while self.process_batch() > 0:
+            continue
+
+    def run(self):
+        while not self.stopped:
+            if len(self.dirty) == 0:
+                self.event.wait(self.interval)
+                self.event.clear()
+                continue
+            cputime = time.thread_time()
+            try:
+                self.process_batch()
+            except Exception:
+                self.event.wait(self.interval) # wait before the failed batch is tried again
+            used = time.thread_time() - cputime
+            if self.budget < 1:
+                time.sleep(used * (1 - self.budget) / self.budget)
+
+    def start(self):
+        # start refreshing in a background thread
+        if not self.thread:
+            self.stopped = False
+            self.thread = threading.Thread(target=self.run,daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        self.event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = False
+
+    def wake(self):
+        # start refreshing right away, instead of after the wait interval
+        self.event.set()
+
+    def stats(self):
+        # return the number of ids in the dirty set, the age of the oldest one (lag, in seconds) and counters of the refreshed (and failed) ids
+        with self.lock:
+            oldest = min([v[0] for v in self.dirty.values()]) if self.dirty else False
+        return {'depth':len(self.dirty),'lag':time.time() - oldest if oldest else 0.0,'processed':self.processed,
+            'batches':self.batches,'errors':self.errors,'dropped':self.dropped,'last_batch':self.last_batch}
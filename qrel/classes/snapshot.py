@@ -0,0 +1,168 @@
+
+import os
+import json
+import bisect
+import struct
+import numpy as np
+
+MAGIC = b'QRELSNAP'
+VERSION = 2
+ALIGNMENT = 64
+
+def write_bundle(path,arrays,meta):
+    """
+    Function to write numpy arrays and a json-serializable dictionary with metadata to a single file
+    The file starts with a fixed prefix (magic string, format version and header length), followed by a json header
+        with the metadata and the dtype, shape and offset of each array; the arrays follow, each aligned to 64 bytes
+    The file is written under a temporary name and moved in place when complete
+    """
+    entries, offset = {}, 0
+    for name,array in arrays.items():
+        array = np.ascontiguousarray(array)
+        entries[name] = {'dtype':array.dtype.str,'shape':list(array.shape),'offset':offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header = json.dumps({'meta':meta,'arrays':entries}).encode('utf-8')
+    start = -(-(len(MAGIC) + 16 + len(header)) // ALIGNMENT) * ALIGNMENT # offset of the first array
+    with open(path + '.tmp','wb') as file_out:
+        file_out.write(MAGIC + struct.pack('<IIQ',VERSION,0,len(header)) + header)
+        for name,array in arrays.items():
+            file_out.seek(start + entries[name]['offset'])
+            file_out.write(np.ascontiguousarray(array).tobytes())
+        file_out.truncate(start + offset)
+        file_out.flush()
+        os.fsync(file_out.fileno())
+    os.replace(path + '.tmp',path)
+
+def read_bundle(path):
+    """
+    Function to open a file written by write_bundle with numpy.memmap
+    returns the metadata and a dictionary with the arrays, as read-only views on the memory map,
+        or False for both if the file is not a bundle of the current format version
+    """
+    with open(path,'rb') as file_in:
+        prefix = file_in.read(len(MAGIC) + 16)
+        if len(prefix) < len(MAGIC) + 16 or prefix[:len(MAGIC)] != MAGIC:
+            return False, False
+        version, reserved, headerlength = struct.unpack('<IIQ',prefix[len(MAGIC):])
+        if version != VERSION:
+            return False, False
+        header = json.loads(file_in.read(headerlength).decode('utf-8'))
+    start = -(-(len(MAGIC) + 16 + headerlength) // ALIGNMENT) * ALIGNMENT
+    data = np.memmap(path,dtype=np.uint8,mode='r')
+    arrays = {}
+    for name,entry in header['arrays'].items():
+        dtype = np.dtype(entry['dtype'])
+        nbytes = int(np.prod(entry['shape'])) * dtype.itemsize
+        arrays[name] = data[start+entry['offset']:start+entry['offset']+nbytes].view(dtype).reshape(entry['shape'])
+    return header['meta'], arrays
+
+def encode_strings(strings):
+    # encode a list of strings as one array with their utf-8 bytes and an array with the offset of each string
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded)+1,dtype=np.int64)
+    np.cumsum([len(e) for e in encoded],out=offsets[1:])
+    return np.frombuffer(b''.join(encoded),dtype=np.uint8), offsets
+
+def decode_strings(blob,offsets):
+    # return the list of strings encoded by encode_strings
+    data = blob.tobytes()
+    offsets = offsets.tolist()
+    return [data[offsets[i]:offsets[i+1]].decode('utf-8') for i in range(len(offsets)-1)]
+
+class StringTable:
+    """
+    class to access the strings encoded by encode_strings one by one, without decoding all of them
+    If the strings are sorted, a string is found by binary search
+    """
+
+    def __init__(self,blob,offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self,i):
+        return self.blob[self.offsets[i]:self.offsets[i+1]].tobytes().decode('utf-8')
+
+    def index(self,string):
+        # return the position of a string in a sorted table, or -1 if it is not in the table
+        i = bisect.bisect_left(self,string)
+        return i if i < len(self) and self[i] == string else -1
+
+def question_arrays(questions):
+    # return the ids (json-encoded, to keep their type) and number of tokens of the given questions as a dictionary of arrays
+    ids, id_offsets = encode_strings([json.dumps(q.id) for q in questions])
+    return {'ids':ids,'id_offsets':id_offsets,'lengths':np.array([len(q.token_ids) for q in questions],dtype=np.int64)}
+
+def file_signature(path):
+    # the size and modification time of a file, to detect if it has changed
+    if not os.path.exists(path):
+        return False
+    stat = os.stat(path)
+    return [stat.st_size,stat.st_mtime]
+
+class Snapshot:
+    """
+    class to store the built serving state of the system (BM25 index, question ids, tfidf vectors, topic tables
+    and ensemble coefficients) in a single file, from which it can be restored without rebuilding it
+    The snapshot records the signature of the model files it was built from (sources);
+        a part of the snapshot is stale, and not used, if one of the source files it depends on has changed since
+    """
+
+    def __init__(self,path,sources):
+        self.path = path
+        self.sources = sources # name -> path of a model file the snapshot depends on
+        self.meta = False
+        self.arrays = False
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        # open the snapshot, returns False if it does not exist or has an outdated format
+        if not self.exists():
+            return False
+        self.meta, self.arrays = read_bundle(self.path)
+        return self.meta is not False
+
+    def fresh(self,names):
+        # check if the snapshot was built from the current version of the given source files
+        if self.meta is False:
+            return False
+        return all([self.meta['sources'].get(name) == file_signature(self.sources[name]) for name in names])
+
+    def contains(self,prefix):
+        # check if the snapshot includes the arrays of the given component, stored under names that start with prefix + '.'
+        return self.arrays is not False and any([name.startswith(prefix + '.') for name in self.arrays])
+
+    def component(self,prefix):
+        # return the arrays of the given component, with the prefix stripped from their names
+        return dict([(name[len(prefix)+1:],array) for name,array in self.arrays.items() if name.startswith(prefix + '.')])
+
+    def matches(self,questions):
+        """
+        Function to check if the snapshot was built from the given questions, or from the first part of them
+        (questions added after the snapshot was written can be indexed on top of it)
+        The ids and the number of tokens of the questions in the snapshot are compared
+        """
+        if not self.contains('questions'):
+            return False
+        arrays = self.component('questions')
+        n = len(arrays['lengths'])
+        if n > len(questions):
+            return False
+        if not (arrays['lengths'] == np.array([len(q.token_ids) for q in questions[:n]],dtype=np.int64)).all():
+            return False
+        return decode_strings(arrays['ids'],arrays['id_offsets']) == [json.dumps(q.id) for q in questions[:n]]
+
+    def write(self,components):
+        """
+        Function to write a snapshot with the arrays of the given components (name of component -> dictionary of arrays)
+        """
+        arrays = {}
+        for prefix,component in components.items():
+            for name,array in component.items():
+                arrays[prefix + '.' + name] = array
+        meta = {'sources':dict([(name,file_signature(path)) for name,path in self.sources.items()])}
+        write_bundle(self.path,arrays,meta)
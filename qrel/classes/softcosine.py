@@ -1,46 +1,126 @@
 
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 
+from qrel.classes import termsim, growable
+
 class SoftCosine:
     """
     class to apply the SoftCosine similarity metric to score the similarity between any two strings,
-    using cosine similarity and based on tfidf values and the semantic representation of the words 
+    using cosine similarity and based on tfidf values and the semantic representation of the words
     returns a similarity score
     """
 
-    def __init__(self,d,tfidf):
+    def __init__(self,d,tfidf,ts=False):
         self.dict = d
         self.tfidf = tfidf
+        self.termsim = ts if ts else termsim.TermSimilarity(d) # similarity between terms, exact if no precomputed matrix is given
+        # tfidf vectors of indexed questions, stored as a sparse matrix in CSR format, and their softcosine norms
+        self.indptr = growable.GrowableArray(np.int64,[0])
+        self.ids = growable.GrowableArray(np.int64)
+        self.weights = growable.GrowableArray(np.float64)
+        self.norms = growable.GrowableArray(np.float64)
+
+    def tfidf_vector(self,q):
+        # return the tfidf vector of a question, as an array of term ids and an array of their tfidf values
+        vector = self.tfidf[self.dict.doc2bow(q.tokens)]
+        return np.array([w[0] for w in vector],dtype=np.int64), np.array([w[1] for w in vector],dtype=np.float64)
+
+    def norm(self,q,vector):
+        # return the softcosine norm of a question, given its tfidf vector
+        return np.sqrt(self.dot(vector,q,vector,q))
+
+    def index(self,questions):
+        # compute and store the tfidf vectors and norms of a list of questions
+        for q in questions:
+            self.add_question(q)
+
+    def add_question(self,q):
+        # compute and store the tfidf vector and norm of a question, which is given the next index
+        vector = self.tfidf_vector(q)
+        self.ids.extend(vector[0])
+        self.weights.extend(vector[1])
+        self.indptr.append(len(self.ids))
+        self.norms.append(self.norm(q,vector))
+
+    def export(self):
+        # return the stored tfidf vectors and norms as a dictionary of arrays, to store them in a snapshot
+        return {'indptr':self.indptr.values(),'ids':self.ids.values(),'weights':self.weights.values(),'norms':self.norms.values()}
+
+    def restore(self,arrays):
+        # restore the tfidf vectors and norms stored in a snapshot, without copying them
+        self.indptr.attach(arrays['indptr'])
+        self.ids.attach(arrays['ids'])
+        self.weights.attach(arrays['weights'])
+        self.norms.attach(arrays['norms'])
+
+    def stored_vector(self,i):
+        # return the stored tfidf vector of the question with index i
+        start, end = self.indptr.values()[i:i+2]
+        return self.ids.values()[start:end], self.weights.values()[start:end]
+
+    def dot(self,q1vector,q1,q2vector,q2):
+        # compute the soft dot product of two tfidf vectors
+        return self.dot_batch(q1vector,q1,[q2vector],[q2])[0]
+
+    def dot_batch(self,q1vector,q1,q2vectors,candidates):
+        """
+        Function to compute the soft dot product of one tfidf vector with several others, as the bilinear forms q1tfidf * M * q2tfidf
+        M holds the similarity of each pair of terms, computed for all pairs in one matrix product;
+            terms that are the same have a similarity of 1
+        Note that the i-th term of a tfidf vector is represented by the i-th token of the question (and its embedding)
+            when computing term similarities, as in the original implementation of this function, to keep the scores the same
+        """
+        q1ids, q1weights = q1vector
+        q2lengths = [len(q2vector[0]) for q2vector in q2vectors]
+        if len(q1ids) == 0 or sum(q2lengths) == 0:
+            return np.zeros(len(q2vectors))
+        q2ids = np.concatenate([q2vector[0] for q2vector in q2vectors])
+        q2weights = np.concatenate([q2vector[1] for q2vector in q2vectors])
+        q2tokens = [] # the tokens of each candidate are decoded once
+        for i,c in enumerate(candidates):
+            q2tokens.extend(c.tokens[:q2lengths[i]])
+        q2emb, segments = termsim.stack([c.emb[:q2lengths[i]] for i,c in enumerate(candidates)])
+        m = self.termsim.similarity_matrix(q1.tokens[:len(q1ids)],q1.emb[:len(q1ids)],q2tokens,q2emb).astype(np.float64)
+        m[q1ids[:,np.newaxis] == q2ids[np.newaxis,:]] = 1.0
+        # sum the products per question by multiplying with a matrix that holds the q2 weights in the column of their question
+        q2matrix = np.zeros((len(q2ids),len(q2vectors)))
+        q2matrix[np.arange(len(q2ids)),segments] = q2weights
+        return q1weights.dot(m).dot(q2matrix)
 
     def apply_model(self,q1,q2):
-        """ 
+        """
         apply softcosine given the embeddings and word tokens of two questions
         Implementation by Thiago Castro Ferreira, formula is based on:
-        Sidorov, G., Gelbukh, A., Gómez-Adorno, H., & Pinto, D. (2014). 
-        Soft similarity and soft cosine measure: Similarity of features in vector space model. 
+        Sidorov, G., Gelbukh, A., Gómez-Adorno, H., & Pinto, D. (2014).
+        Soft similarity and soft cosine measure: Similarity of features in vector space model.
         Computación y Sistemas, 18(3), 491-504.
         """
 
-        def dot(q1tfidf, q1emb, q2tfidf, q2emb):
-            cos = 0.0
-            for i, w1 in enumerate(q1tfidf):
-                for j, w2 in enumerate(q2tfidf):
-                    if w1[0] == w2[0]:
-                        cos += (w1[1] * w2[1])
-                    else:
-                        m_ij = max(0, cosine_similarity([q1emb[i]], [q2emb[j]])[0][0])**2
-                        cos += (w1[1] * m_ij * w2[1])
-            return cos
-
         # return the tfidf vectors for the two questions
-        q1tfidf = self.tfidf[self.dict.doc2bow(q1.tokens)]
-        q2tfidf = self.tfidf[self.dict.doc2bow(q2.tokens)]
+        q1tfidf = self.tfidf_vector(q1)
+        q2tfidf = self.tfidf_vector(q2)
 
         # intermediate steps for softcosine calculation
-        q1q1 = np.sqrt(dot(q1tfidf, q1.emb, q1tfidf, q1.emb))
-        q2q2 = np.sqrt(dot(q2tfidf, q2.emb, q2tfidf, q2.emb))
+        q1q1 = self.norm(q1, q1tfidf)
+        q2q2 = self.norm(q2, q2tfidf)
 
         # calculate softcosine
-        softcosine = dot(q1tfidf, q1.emb, q2tfidf, q2.emb) / (q1q1 * q2q2)
+        softcosine = self.dot(q1tfidf, q1, q2tfidf, q2) / (q1q1 * q2q2)
         return softcosine
+
+    def apply_model_batch(self,q1,candidates,indices=None):
+        """
+        apply softcosine to a question and a list of candidate questions at once
+        The tfidf vector and norm of q1 are computed once, and the dot products with all candidates in one matrix product;
+            if the indices of the candidates are given, their stored tfidf vectors and norms are used
+        returns an array with the softcosine score of each candidate
+        """
+        q1tfidf = self.tfidf_vector(q1)
+        q1q1 = self.norm(q1, q1tfidf)
+        if indices is None:
+            q2tfidfs = [self.tfidf_vector(c) for c in candidates]
+            q2q2s = np.array([self.norm(c, q2tfidf) for q2tfidf,c in zip(q2tfidfs,candidates)])
+        else:
+            q2tfidfs = [self.stored_vector(i) for i in indices]
+            q2q2s = self.norms.values()[np.asarray(indices,dtype=np.int64)]
+        return self.dot_batch(q1tfidf, q1, q2tfidfs, candidates) / (q1q1 * q2q2s)
@@ -0,0 +1,125 @@
+
+import numpy as np
+from scipy import sparse
+
+def normalize(emb):
+    """
+    Function to L2-normalize the word embeddings of a question (one row per token)
+    Rows with a norm of 0 (unknown words) are left as they are, like sklearn's cosine_similarity does
+    """
+    emb = np.asarray(emb,dtype=np.float32)
+    norms = np.sqrt(np.einsum('ij,ij->i',emb,emb))
+    norms[norms == 0.0] = 1.0
+    return emb / norms[:,np.newaxis]
+
+def similarity_matrix(emb1,emb2):
+    """
+    Function to compute the similarity between all pairs of tokens of two questions in one matrix product
+    The similarity of two tokens is their cosine similarity, set to 0 if negative and squared
+    """
+    if len(emb1) == 0 or len(emb2) == 0:
+        return np.zeros((len(emb1),len(emb2)),dtype=np.float32)
+    return np.maximum(normalize(emb1).dot(normalize(emb2).T),0) ** 2
+
+def stack(embs):
+    """
+    Function to stack the word embeddings of several questions into one matrix
+    returns the matrix and, for each of its rows, the index of the question it belongs to
+    """
+    blocks = [np.asarray(emb,dtype=np.float32) for emb in embs if len(emb) > 0]
+    segments = np.repeat(np.arange(len(embs)),[len(emb) for emb in embs])
+    if len(blocks) == 0:
+        return np.zeros((0,0),dtype=np.float32), segments
+    return np.concatenate(blocks), segments
+
+class TermSimilarity:
+    """
+    class to look up the similarity between word tokens in a precomputed sparse matrix over the dictionary vocabulary
+    The matrix stores, for each term, the similarity to its k nearest neighbours in word2vec space that are above a threshold;
+    pairs of terms that are not stored (including pairs with a term outside the matrix) are computed exactly from the embeddings,
+    so that the similarities are the same as without a matrix, which computes all similarities exactly
+    """
+
+    def __init__(self,d):
+        self.dict = d
+        self.matrix = False # sparse matrix (scipy CSR) with the similarity between dictionary ids
+        self.known = False # boolean array marking the dictionary ids that are part of the matrix
+
+    def build(self,encoder,k=100,threshold=0.3,chunksize=256):
+        """
+        Function to compute the sparse term-similarity matrix from the word2vec embeddings of the dictionary vocabulary
+        For each term, the k most similar terms with a cosine similarity of at least the threshold are kept;
+        the matrix is made symmetric by keeping a pair if it is kept for either of its terms
+        """
+        words = [w for w in self.dict.token2id if w in encoder.word2row]
+        ids = np.array([self.dict.token2id[w] for w in words],dtype=np.int64)
+        vectors = normalize(encoder.encode(words))
+        k = min(k,len(words))
+        rows, cols, values = [], [], []
+        for start in range(0,len(words),chunksize):
+            if (start // chunksize) % 100 == 0:
+                print('Term',start,'of',len(words))
+            sims = vectors[start:start+chunksize].dot(vectors.T)
+            neighbours = np.argpartition(-sims,k-1,axis=1)[:,:k]
+            neighbour_sims = np.take_along_axis(sims,neighbours,axis=1)
+            chunk_rows, chunk_cols = np.nonzero(neighbour_sims >= threshold)
+            chunk_neighbours = neighbours[chunk_rows,chunk_cols]
+            other = chunk_neighbours != start + chunk_rows # the similarity of a term to itself is added below
+            rows.append(ids[start + chunk_rows[other]])
+            cols.append(ids[chunk_neighbours[other]])
+            values.append(np.maximum(neighbour_sims[chunk_rows[other],chunk_cols[other]],0) ** 2)
+        # a term is completely similar to itself
+        rows.append(ids)
+        cols.append(ids)
+        values.append(np.ones(len(ids),dtype=np.float32))
+        size = len(self.dict)
+        matrix = sparse.csr_matrix((np.concatenate(values),(np.concatenate(rows),np.concatenate(cols))),shape=(size,size),dtype=np.float32)
+        self.matrix = matrix.maximum(matrix.T).tocsr()
+        self.known = np.zeros(size,dtype=bool)
+        self.known[ids] = True
+
+    def save(self,path):
+        # write the matrix to file, as the arrays of its CSR representation
+        np.savez(path,data=self.matrix.data,indices=self.matrix.indices,indptr=self.matrix.indptr,shape=self.matrix.shape,known=self.known)
+
+    def load(self,path):
+        # read the matrix from file
+        arrays = np.load(path)
+        self.matrix = sparse.csr_matrix((arrays['data'],arrays['indices'],arrays['indptr']),shape=tuple(arrays['shape']))
+        self.known = arrays['known']
+
+    def ids(self,tokens):
+        # return the dictionary ids of the given tokens, and whether they are part of the matrix
+        ids = np.array([self.dict.token2id.get(t,-1) for t in tokens],dtype=np.int64)
+        if self.matrix is False:
+            return ids, np.zeros(len(ids),dtype=bool)
+        return ids, (ids >= 0) & self.known[np.maximum(ids,0)]
+
+    def similarity_matrix(self,tokens1,emb1,tokens2,emb2):
+        """
+        Function to return the similarity between all pairs of tokens of two questions
+        Pairs of which both tokens are part of the precomputed matrix are looked up, the others are computed from the embeddings;
+            this includes pairs of known terms that are not stored (below the threshold or outside the k nearest neighbours),
+            which are computed for the rows and columns that have such a pair only
+        """
+        if self.matrix is False or len(tokens1) == 0 or len(tokens2) == 0:
+            return similarity_matrix(emb1,emb2)
+        ids1, known1 = self.ids(tokens1)
+        ids2, known2 = self.ids(tokens2)
+        m = np.zeros((len(tokens1),len(tokens2)),dtype=np.float32)
+        if known1.any() and known2.any():
+            m[np.ix_(known1,known2)] = self.matrix[ids1[known1]][:,ids2[known2]].toarray()
+        emb1, emb2 = np.asarray(emb1,dtype=np.float32), np.asarray(emb2,dtype=np.float32)
+        missing = np.zeros(m.shape,dtype=bool) # pairs of known terms that are not stored
+        missing[np.ix_(known1,known2)] = m[np.ix_(known1,known2)] == 0
+        if missing.any():
+            rows, cols = missing.any(axis=1), missing.any(axis=0)
+            exact = similarity_matrix(emb1[rows],emb2[cols])
+            block = m[np.ix_(rows,cols)]
+            block[missing[np.ix_(rows,cols)]] = exact[missing[np.ix_(rows,cols)]]
+            m[np.ix_(rows,cols)] = block
+        if not known1.all():
+            m[~known1,:] = similarity_matrix(emb1[~known1],emb2)
+        if not known2.all():
+            m[np.ix_(known1,~known2)] = similarity_matrix(emb1[known1],emb2[~known2])
+        return m
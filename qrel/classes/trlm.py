@@ -1,7 +1,8 @@
 
 import json
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+
+from qrel.classes import termsim
 
 class TRLM:
     """
@@ -10,8 +11,9 @@ class TRLM:
     returns a similarity score
     """
 
-    def __init__(self,d):
+    def __init__(self,d,ts=False):
         self.dict = d
+        self.termsim = ts if ts else termsim.TermSimilarity(d) # similarity between terms, exact if no precomputed matrix is given
         self.alpha = False
         self.sigma = False
         self.prob_w_C = False
@@ -46,6 +48,13 @@ class TRLM:
         self.sigma = translation['sigma']
         self.prob_w_C = translation['w_Q']
 
+    def collection_probability(self,w):
+        # return the probability of a word in the collection, or a uniform probability for unknown words
+        try:
+            return self.prob_w_C[w[0]][w]
+        except:
+            return 1.0 / len(self.dict)
+
     def apply_model(self,q1,q2):
         """ 
         apply TRLM given the trained probabilities and word tokens of two questions
@@ -54,31 +63,42 @@ class TRLM:
         In Proceedings of the 31st annual international ACM SIGIR conference on Research and development in information retrieval 
         (pp. 475-482). ACM.
         """
-        score = 0.0
-        if len(q1.tokens) == 0 or len(q2.tokens) == 0: return 0.0
-
-        Q_count = len(q2.tokens)
+        return self.apply_model_batch(q1,[q2])[0]
 
+    def apply_model_batch(self,q1,candidates):
+        """
+        apply TRLM to a question and a list of candidate questions at once
+        The translation probabilities between the tokens of q1 and those of all candidates are computed in one matrix product
+        returns an array with the TRLM score of each candidate (0.0 for a candidate without tokens)
+        """
+        scores = np.zeros(len(candidates))
+        q1tokens = q1.tokens # decoded once, the property returns a new list on every read
+        if len(q1tokens) == 0: return scores
+        candidates = [(i,c,c.tokens) for i,c in enumerate(candidates)]
+        candidates = [(i,c,tokens) for i,c,tokens in candidates if len(tokens) > 0]
+        if len(candidates) == 0: return scores
+
+        # term frequencies in each candidate, counted in a single pass
         t_Qs = []
-        for t in q2.tokens:
-            t_Q = float(q2.tokens.count(t)) / Q_count
-            t_Qs.append(t_Q)
-
-        for i, w in enumerate(q1.tokens):
-            try:
-                w_C = self.prob_w_C[w[0]][w]
-            except:
-                w_C = 1.0 / len(self.dict)
-
-            ml_w_Q = float(q2.tokens.count(w)) / Q_count
-            mx_w_Q = 0.0
-
-            for j, t in enumerate(q2.tokens):
-                w_t = max(0, cosine_similarity([q1.emb[i]], [q2.emb[j]])[0][0]) ** 2
-
-                t_Q = t_Qs[j]
-                mx_w_Q += (w_t * t_Q)
-            w_Q = (self.sigma * mx_w_Q) + ((1-self.sigma) * ml_w_Q)
-            score += np.log(((1-self.alpha) * w_Q) + (self.alpha * w_C))
-
-        return score
+        ml_w_Q = np.zeros((len(q1tokens),len(candidates)))
+        for k,(i,c,tokens) in enumerate(candidates):
+            Q_count = float(len(tokens))
+            counts = {}
+            for t in tokens:
+                counts[t] = counts.get(t,0) + 1
+            t_Qs.extend([counts[t] / Q_count for t in tokens])
+            ml_w_Q[:,k] = [counts.get(w,0) / Q_count for w in q1tokens]
+        w_C = np.array([self.collection_probability(w) for w in q1tokens])
+
+        # translation probabilities for all pairs of tokens in one matrix product,
+        # summed per candidate by multiplying with a matrix that holds the term frequencies in the column of their candidate
+        q2tokens = [t for i,c,tokens in candidates for t in tokens]
+        q2emb, segments = termsim.stack([c.emb for i,c,tokens in candidates])
+        w_t = self.termsim.similarity_matrix(q1tokens,q1.emb,q2tokens,q2emb).astype(np.float64)
+        q2matrix = np.zeros((len(t_Qs),len(candidates)))
+        q2matrix[np.arange(len(t_Qs)),segments] = t_Qs
+        mx_w_Q = w_t.dot(q2matrix)
+
+        w_Q = (self.sigma * mx_w_Q) + ((1-self.sigma) * ml_w_Q)
+        scores[[i for i,c,tokens in candidates]] = np.log(((1-self.alpha) * w_Q) + (self.alpha * w_C[:,np.newaxis])).sum(axis=0)
+        return scores
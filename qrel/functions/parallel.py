@@ -0,0 +1,68 @@
+
+import sys
+import time
+import multiprocessing
+
+task = False # function applied by the worker processes, inherited when they are forked
+
+def apply_task(chunk):
+    # apply the task to a chunk of items (given by its start and end index) in a worker process
+    start, end = chunk
+    return start, task(start,end)
+
+class Progress:
+    """
+    Class to report the progress of a long-running procedure on a single line, which is overwritten on every update
+    """
+
+    def __init__(self,label,total,interval=1.0):
+        self.label = label
+        self.total = total
+        self.interval = interval # minimal number of seconds between two updates
+        self.done = 0
+        self.start = time.time()
+        self.last = 0
+
+    def update(self,n):
+        # count n more items as done, and report the progress if the last report is long enough ago (or all items are done)
+        self.done += n
+        now = time.time()
+        if now - self.last >= self.interval or self.done == self.total:
+            self.last = now
+            rate = self.done / max(now - self.start,1e-9)
+            sys.stdout.write('\r' + self.label + ': ' + str(self.done) + ' of ' + str(self.total) + ' (' + str(round(rate,1)) + ' per second)')
+            if self.done == self.total:
+                sys.stdout.write('\n')
+            sys.stdout.flush()
+
+def map_chunks(function,n,processes=1,chunksize=100,label='Items'):
+    """
+    Function to apply a function to n items in chunks, in parallel worker processes
+    The function is called with the start and end index of a chunk and should return a list with the result for each item in it;
+        the results of all chunks are returned as a single list, in the order of the items
+    The worker processes are forked, so that they inherit the function and all objects it refers to (such as models and questions)
+        without pickling them; memory-mapped files are shared through the page cache. Only the chunk indices and results are pickled
+    If processes is 1, or forking is not available on the platform, the chunks are processed in the current process
+    """
+    global task
+    chunks = [(start,min(start+chunksize,n)) for start in range(0,n,chunksize)]
+    progress = Progress(label,n)
+    results = [None] * n
+    try:
+        context = multiprocessing.get_context('fork') if processes != 1 else False
+    except ValueError: # forking is not available
+        context = False
+    if not context:
+        for start,end in chunks:
+            results[start:end] = function(start,end)
+            progress.update(end-start)
+        return results
+    task = function
+    try:
+        with context.Pool(processes) as pool:
+            for start,chunk_results in pool.imap_unordered(apply_task,chunks):
+                results[start:start+len(chunk_results)] = chunk_results
+                progress.update(len(chunk_results))
+    finally:
+        task = False
+    return results
@@ -6,9 +6,10 @@ class QuestionRelator:
     Class to retrieve a set of related questions to a given question, optimized for relevance, novelty and diversity
     """
 
-    def __init__(self,sim_model):
+    def __init__(self,sim_model,retriever='bm25'):
         # A trained similarity model is essential to the question relatedness procedure
         self.sim_model = sim_model
+        self.retriever = retriever # retriever of candidates: 'bm25', 'dense' or 'hybrid' (see QSim.retrieve_candidates)
 
     ##################################
     ### TOPIC FUNCTIONS ##############
@@ -47,28 +48,44 @@ class QuestionRelator:
     ### SIMILARITY FUNCTIONS #########
     ##################################
 
-    def retrieve_diverse_candidates(self,question,topic_cutoff,ntargets):
+    def retrieve_diverse_candidates(self,question,topic_cutoff,ntargets,version=False,retriever=False):
         """
-        Function to retrieve a diverse set of candidate related questions based on BM25
+        Function to retrieve a diverse set of candidate related questions based on BM25 (by default), the dense index or both (retriever)
         In order to retrieve questions that might link more to particular topics of a question and still adhere to
             the formulation in the given question, BM25 is requested to retrieve candidates for multiple variants:
             * the complete question
             * the question stripped from topic1
             * the question stripped frop topic2
             * etc.
+        All candidates are retrieved from the given version of the index (by default the current version)
+        """
+        retriever = retriever if retriever else self.retriever
+        queries, ntargets_by_chunk = self.diverse_queries(question,topic_cutoff,ntargets)
+        return self.merge_candidates(question,[self.sim_model.retrieve_candidates(tokens,ntargets_by_chunk,version,retriever) for tokens in queries])
 
+    def diverse_queries(self,question,topic_cutoff,ntargets):
+        """
+        Function to return the variants of a question (lists of word tokens) for which candidates are retrieved, 
+            and the number of candidates to retrieve for each of them
         """
         if topic_cutoff == 1: # if question has only one prominent topic, only candidates based on the complete question are retrieved
             ntargets_by_chunk = ntargets
         else:
             ntargets_by_chunk = int(ntargets / (topic_cutoff+1)) # to make sure that the requested number of targets are retrieved, the size of the chunks per query question are decided here
-        candidates = self.sim_model.retrieve_candidates(question.tokens,ntargets_by_chunk) # first retrieve candidates from the complete question
-        cids = [question.id] + [c.id for c in candidates]
+        tokens = question.tokens
+        queries = [tokens] # first retrieve candidates from the complete question
         if topic_cutoff > 1: 
-            # for each topic (if more than 1)
+            # for each topic (if more than 1) retrieve questions based on the question minus the topic
             for i,topic in enumerate(question.topics[:topic_cutoff]):
-                # retrieve questions based on the question minus the topic, and add to combined list (making sure that any retrieved question was not already in the list)
-                candidates.extend([c for c in self.sim_model.retrieve_candidates(list(set(question.tokens) - set(topic['topic_text'].split())),ntargets_by_chunk) if c.id not in cids])
+                queries.append(list(set(tokens) - set(topic['topic_text'].split())))
+        return queries, ntargets_by_chunk
+
+    def merge_candidates(self,question,retrieved):
+        # combine the candidates retrieved for each variant of a question (making sure that any retrieved question was not already in the list)
+        candidates = list(retrieved[0])
+        cids = [question.id] + [c.id for c in candidates]
+        for variant in retrieved[1:]:
+            candidates.extend([c for c in variant if c.id not in cids])
         return candidates
 
     def rank_questions_topic(self,question,topic,targets):
@@ -121,16 +138,21 @@ class QuestionRelator:
     def relate_question(self,question,topic_percentage=0.70,ncandidates=50,num_related=5):
         """
         Complete question relatedness procedure
+        The candidates are retrieved and scored with one version of the index, which does not change while questions are added
         """
+        if self.retriever != 'bm25':
+            self.sim_model.require('dense') # before the version is taken, so that it includes the dense index
+        version = self.sim_model.version
+
         # select prominent topics of question
         topic_cutoff = self.select_topics(question,topic_percentage)
 
         # retrieve candidate questions
-        candidates = self.retrieve_diverse_candidates(question,topic_cutoff,ncandidates)
+        candidates = self.retrieve_diverse_candidates(question,topic_cutoff,ncandidates,version)
         candidates_output = [c.id for c in candidates]
 
         # score and rank questions by similarity
-        ranked_candidates = self.sim_model.rerank_candidates(question,candidates,'ensemble')
+        ranked_candidates = self.sim_model.rerank_candidates(question,candidates,'ensemble',version)
         
         # filter questions labeled as similar (duplicate) by the similarity ranking
         ranked_candidates_filtered = [c for c in ranked_candidates if c[-1] == 0]
@@ -139,3 +161,30 @@ class QuestionRelator:
         related_questions = self.select_related_questions(question,topic_cutoff,ranked_candidates_filtered,num_related)
 
         return related_questions, candidates_output
+
+    def relate_questions(self,questions,topic_percentage=0.70,ncandidates=50,num_related=5):
+        """
+        Complete question relatedness procedure for several questions at once, with the same outcome as relate_question for each of them
+        The candidates for all variants of all questions are retrieved in one pass over the BM25 index,
+            and the candidates of all questions are scored by the ensemble model in one call
+        """
+        if self.retriever != 'bm25':
+            self.sim_model.require('dense') # before the version is taken, so that it includes the dense index
+        version = self.sim_model.version
+        topic_cutoffs = [self.select_topics(q,topic_percentage) for q in questions]
+        queries = [self.diverse_queries(q,topic_cutoff,ncandidates) for q,topic_cutoff in zip(questions,topic_cutoffs)]
+        # the variants of all questions with the same number of targets are retrieved together
+        candidates = [False] * len(questions)
+        for ntargets in set([ntargets_by_chunk for variants,ntargets_by_chunk in queries]):
+            indices = [i for i,(variants,ntargets_by_chunk) in enumerate(queries) if ntargets_by_chunk == ntargets]
+            retrieved = self.sim_model.retrieve_candidates_batch([tokens for i in indices for tokens in queries[i][0]],ntargets,version,self.retriever)
+            start = 0
+            for i in indices:
+                candidates[i] = self.merge_candidates(questions[i],retrieved[start:start+len(queries[i][0])])
+                start += len(queries[i][0])
+        ranked_candidates = self.sim_model.rerank_candidates_batch(questions,candidates,'ensemble',version)
+        output = []
+        for q,topic_cutoff,c,ranked in zip(questions,topic_cutoffs,candidates,ranked_candidates):
+            ranked_filtered = [x for x in ranked if x[-1] == 0]
+            output.append((self.select_related_questions(q,topic_cutoff,ranked_filtered,num_related),[x.id for x in c]))
+        return output
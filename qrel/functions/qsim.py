@@ -3,7 +3,36 @@ import os
 import json
 import numpy as np
 
-from qrel.classes import question, gv_bm25, trlm, softcosine, ensemble
+from qrel.classes import question, gv_bm25, trlm, softcosine, ensemble, embedding_store, encoder, termsim, dense_index
+
+RRF_K = 60
+
+def reciprocal_rank_fusion(rankings,n,k=RRF_K):
+    """
+    Function to combine several rankings (lists of [index, score]) into one by reciprocal rank fusion (Cormack et al., 2009):
+        each index is scored by the sum of 1 / (k + rank) over the rankings it appears in
+    returns the n highest scoring indices as a list of [index, fused score], ties are ranked by index
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank,(i,score) in enumerate(ranking):
+            fused[i] = fused.get(i,0.0) + 1.0 / (k + rank + 1)
+    return [[i,score] for i,score in sorted(fused.items(),key = lambda x : (-x[1],x[0]))[:n]]
+
+class IndexVersion:
+    """
+    A read-only version of the index, with the questions that were added to it when the version was made:
+        their number (size), a BM25 model that scores them and (if it is used) the dense index of their vectors
+    Questions are added to the index by building the next version and replacing the current version with it (copy-on-write), 
+        so that a question is scored against one consistent version without locks while questions are added
+    The tfidf vectors, norms and embeddings of questions are only appended, and shared by all versions
+    """
+
+    def __init__(self,number,size,bm25,dense=False):
+        self.number = number # increased with every version
+        self.size = size
+        self.bm25 = bm25
+        self.dense = dense
 
 class QSim:
     """
@@ -20,28 +49,121 @@ class QSim:
         self.d = d
         self.tfidf = tfidf
         self.w2v = w2v
+        self.encoder = encoder.Encoder(w2v,d)
+        self.termsim = termsim.TermSimilarity(d)
         self.model = False
         self.gv_bm25 = False
+        self.embeddings = False
+        self.dense = False
+        self.weighting = 'tfidf' # weighting of the token embeddings in the question vectors of the dense index
         self.trlm = False
         self.softcosine = False
         self.ensemble = False
+        self.version = False # the current version of the index
+        self.deferred = {} # name of component -> function to initialize it on first use
 
     ############
     ### INIT ###
     ############
 
-    def init_bm25(self):
-        # Initialize BM25 model by storing question word tokens
+    def defer(self,component,function):
+        """
+        Function to postpone the initialization of a component ('trlm', 'softcosine', 'ensemble' or 'dense') until it is first used
+        The given function should initialize the component, and return only when it is initialized
+        """
+        self.deferred[component] = function
+
+    def require(self,*components):
+        # initialize the given components, if their initialization was postponed
+        for component in components:
+            if component in self.deferred:
+                self.deferred[component]()
+                self.deferred.pop(component,None)
+
+    def init_bm25(self,stored=False):
+        """
+        Initialize BM25 model by storing question word tokens, or by restoring the arrays of a snapshot (stored)
+        Questions added after the snapshot was written are added to the restored model;
+            this should be done before the embeddings are initialized, as it does not encode these questions
+        """
         self.gv_bm25 = gv_bm25.GV_BM25()
-        print('Training BM25model...')
-        self.gv_bm25.init_model([q.tokens for q in self.questions])
+        if stored:
+            print('Restoring BM25 model from snapshot...')
+            self.gv_bm25.restore(stored)
+            self.update_index()
+        else:
+            print('Training BM25model...')
+            self.gv_bm25.init_model([q.tokens for q in self.questions])
+        self.publish()
+
+    def init_embeddings(self,embeddingspath,sources={}):
+        """
+        Initialize the store with word embeddings of all questions, either by opening it from file 
+        or by encoding all questions and writing it to file (also if one of the model files in sources changed since it was written)
+        Each question is given a zero-copy view on its embeddings in the store
+        """
+        self.embeddings = embedding_store.EmbeddingStore(embeddingspath,self.encoder.dim,sources)
+        if self.embeddings.exists():
+            self.embeddings.load()
+        if not self.embeddings.exists() or not self.embeddings.fresh() or not self.embeddings.matches(self.questions):
+            print('Embeddings in',embeddingspath,'missing or outdated, encoding questions...')
+            self.embeddings.build(self.questions,self.encode)
+        self.embeddings.truncate(len(self.questions))
+        for i,q in enumerate(self.questions):
+            if i < len(self.embeddings):
+                q.set_emb(self.embeddings.get(i))
+            else: # questions added after the store was written
+                self.embeddings.append(self.encode(q.tokens))
+                q.set_emb(self.embeddings.get(i))
+
+    def init_dense(self,stored=False,weighting='tfidf'):
+        """
+        Initialize the dense retriever, an approximate nearest neighbour index of the questions represented as single vectors 
+            (see question_vector), either by restoring it from stored arrays or by building it
+        Questions added after the index was stored are added to the restored index
+        """
+        self.weighting = weighting
+        model = dense_index.DenseIndex(self.encoder.dim)
+        if stored:
+            model.restore(stored)
+        else:
+            print('Building dense index...')
+            model.build([self.question_vector(q.tokens,q.emb) for q in self.questions])
+        for q in self.questions[len(model):]:
+            model.add(self.question_vector(q.tokens,q.emb))
+        self.dense = model
+        self.publish()
+
+    def save_embeddings(self,remap=False):
+        """
+        Function to write the embeddings of added questions to the store
+        If remap is True, the store is opened again and all questions are pointed to their embeddings in it, 
+            so that earlier memory maps of the store are released; this is done only when the dataset is compacted,
+            as every map of the store takes as much address space as its files
+        """
+        if remap:
+            self.embeddings.remap()
+            for i,q in enumerate(self.questions[:len(self.embeddings)]):
+                q.set_emb(self.embeddings.get(i))
+        else:
+            self.embeddings.flush()
+
+    def init_termsim(self,termsimpath):
+        """
+        Initialize the precomputed term-similarity matrix shared by TRLM and SoftCosine, if it was built
+        Without it, the similarity between terms is computed from their embeddings
+        """
+        if os.path.exists(termsimpath):
+            self.termsim.load(termsimpath)
+        else:
+            print('File with term similarities',termsimpath,'does not exist, computing term similarities from embeddings')
 
     def init_trlm(self,modelpath):
         """
         Initialize translation-based language model, either by loading the model from a file 
         or training it based on the question tokens
         """
-        self.trlm = trlm.TRLM(self.d)
+        self.trlm = trlm.TRLM(self.d,self.termsim)
         if os.path.exists(modelpath):
             self.trlm.load_model(modelpath)
         else:
@@ -50,17 +172,30 @@ class QSim:
             print('Done. Saving model to',modelpath)
             self.trlm.save_model(modelpath)
 
-    def init_softcosine(self):
-        # Initialize softcosine model by loading disctionary and tfidf
-        self.softcosine = softcosine.SoftCosine(self.d,self.tfidf)
+    def init_softcosine(self,stored=False):
+        """
+        Initialize softcosine model by loading disctionary and tfidf
+        The tfidf vectors and softcosine norms of all questions are computed once and stored in the model,
+            or restored from the arrays of a snapshot (stored) for the questions in the snapshot
+        """
+        model = softcosine.SoftCosine(self.d,self.tfidf,self.termsim)
+        for q in self.questions:
+            if len(q.emb) == 0:
+                q.set_emb(self.encode(q.tokens))
+        if stored:
+            model.restore(stored)
+        model.index(self.questions[len(model.norms):])
+        self.softcosine = model # set when indexed, so that questions added in the meantime are indexed only once
 
-    def init_ensemble(self,ensemblepath,traindatapath):
+    def init_ensemble(self,ensemblepath,traindatapath,stored=False):
         """
-        Initialize ensemble model, either by loading the model from a file 
+        Initialize ensemble model, either by restoring its coefficients from a snapshot (stored), by loading the model from a file 
         or training it based on a file with training questions labeled for their similarity
         """
         self.ensemble = ensemble.Ensemble()
-        if os.path.exists(ensemblepath): # load model
+        if stored:
+            self.ensemble.restore(stored)
+        elif os.path.exists(ensemblepath): # load model
             print('Loading ensemble model')
             self.ensemble.load_model(ensemblepath)
         else: # train model
@@ -116,15 +251,28 @@ class QSim:
 
     def encode(self,tokens):
         """
-        Function to encode question word tokens as a list of the word2vec dimensions per tokens
+        Function to encode question word tokens as a matrix with the word2vec dimensions per token
+        tokens that are not known by the word2vec model are encoded as a row of 0's
+        """
+        return self.encoder.encode(tokens)
+
+    def question_vector(self,tokens,emb=False):
+        """
+        Function to represent a question as a single vector for the dense retriever: the sum of the embeddings of its tokens, 
+            weighted by their idf (weighting 'tfidf', tokens that are not in the dictionary are left out) or unweighted ('mean'), 
+            normalized to unit length
         """
-        emb = []
-        for t in tokens:
-            try:
-                emb.append(self.w2v[t]) # add the 300 dimensions of the word as stored in the word2vec model to the encoding
-            except:
-                emb.append(300 * [0]) # if the word is not known by the word2vec model, store as a list of 0's
-        return emb
+        if emb is False or len(emb) != len(tokens):
+            emb = self.encode(tokens)
+        if len(tokens) == 0:
+            return np.zeros(self.encoder.dim,dtype=np.float32)
+        if self.weighting == 'tfidf':
+            weights = np.array([self.tfidf.idfs.get(self.d.token2id.get(t,-1),0.0) for t in tokens],dtype=np.float32)
+        else:
+            weights = np.ones(len(tokens),dtype=np.float32)
+        vector = weights.dot(np.asarray(emb,dtype=np.float32).reshape(len(tokens),self.encoder.dim))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
 
     def id2question(self):
         """
@@ -145,8 +293,36 @@ class QSim:
         q.import_qdict(qdict)
         q.set_emb(self.encode(q.tokens))
         self.questions.append(q)
-        self.id2q[q.id] = len(self.questions)-1
-        self.gv_bm25.init_model([q.tokens for q in self.questions])
+        self.update_index()
+
+    def update_index(self):
+        """
+        Function to add questions that were appended to the list of questions to the index, without reinitializing it
+        The BM25 model, the embedding store and the stored softcosine vectors are extended with the new questions 
+            and id2q is updated in place; the new questions are scored once they are all added, in the next version of the index
+        Questions should be added by one thread at a time
+        """
+        for i in range(self.gv_bm25.size(),len(self.questions)):
+            q = self.questions[i]
+            self.id2q[q.id] = i
+            self.gv_bm25.add_question(q.tokens)
+            if self.embeddings is not False:
+                self.embeddings.append(q.emb if len(q.emb) > 0 else self.encode(q.tokens))
+                q.set_emb(self.embeddings.get(i))
+            if self.softcosine:
+                if len(q.emb) == 0:
+                    q.set_emb(self.encode(q.tokens))
+                self.softcosine.add_question(q)
+            if self.dense is not False:
+                self.dense.add(self.question_vector(q.tokens,q.emb))
+        self.publish()
+
+    def publish(self):
+        # replace the current version of the index by one with all questions added to the BM25 model (and the dense index)
+        if self.version and self.version.size == self.gv_bm25.size() and (self.version.dense is False) == (self.dense is False):
+            return
+        self.version = IndexVersion(self.version.number + 1 if self.version else 0,self.gv_bm25.size(),self.gv_bm25.freeze(),
+            self.dense.freeze() if self.dense is not False else False)
 
 
     ##########################
@@ -157,18 +333,21 @@ class QSim:
         """
         Function to assess the similarity between two questions based on a trained ensemble model
         """
+        self.require('ensemble')
         try:
             return self.ensemble.apply_model(self.return_scores(question1,question2))
         except ValueError: # vectors not workable
             print('Could not calculate similarity between particular questions, returning 0-values')
             return [0.0,0]
 
-    def return_scores(self,question1,question2):
+    def return_scores(self,question1,question2,version=False):
         """
         Function to the similarity scores for two questions based on the three separate models
-        (BM25, Softcosine and TRLM)
+        (BM25, Softcosine and TRLM), using the given version of the index (by default the current version)
         """
-        bm25score = self.gv_bm25.return_score(question1, self.id2q[question2.id])
+        self.require('trlm','softcosine')
+        version = version if version else self.version
+        bm25score = version.bm25.return_score(question1, self.id2q[question2.id])
         translation = self.trlm.apply_model(question1, question2)
         softcosine = self.softcosine.apply_model(question1, question2)
         if not np.isnan(softcosine):
@@ -176,38 +355,126 @@ class QSim:
         else:
             return False
 
-    def retrieve_candidates(self,questiontokens,n):
+    def return_scores_batch(self,question,candidates,version=False):
+        """
+        Function to return the similarity scores between a question and a list of candidate questions
+        based on the three separate models (BM25, Softcosine and TRLM), as a matrix with one row per candidate
+        """
+        self.require('trlm','softcosine')
+        version = version if version else self.version
+        indices = [self.id2q[c.id] for c in candidates]
+        bm25scores = version.bm25.return_score_batch(question,indices)
+        translation = self.trlm.apply_model_batch(question,candidates)
+        softcosine = self.softcosine.apply_model_batch(question,candidates,indices)
+        return np.column_stack([bm25scores,translation,softcosine])
+
+    def retrieve_candidates(self,questiontokens,n,version=False,retriever='bm25'):
         """
         Function to retrieve candidate similar questions to a given set of question word tokens based on bm25
         In a subsequent step these candidates could be reranked by other (more time-consuming) metrics
-        'n' gives the number of candidates to return
+        'n' gives the number of candidates to return, from the given version of the index (by default the current version)
+        The candidates are retrieved by BM25 (retriever 'bm25'), by the dense index ('dense'), 
+            or by both, combined by reciprocal rank fusion ('hybrid'); the last two initialize the dense index if it was postponed
         """
-        scores = self.gv_bm25.return_scores(questiontokens)
-        scores_numbers = [[i,score] for i,score in enumerate(scores)]
-        scores_numbers_ranked = sorted(scores_numbers,key = lambda k : k[1],reverse=True)
-        return [self.questions[i] for i,score in scores_numbers_ranked[:n]]
+        version = self.retriever_version(version,retriever)
+        if retriever == 'bm25':
+            scores_numbers_ranked = version.bm25.return_top(questiontokens,n)
+        elif retriever == 'dense':
+            scores_numbers_ranked = version.dense.search(self.question_vector(questiontokens),n)
+        else:
+            scores_numbers_ranked = self.hybrid_top(version.bm25.return_top(questiontokens,2*n),questiontokens,n,version)
+        return [self.questions[i] for i,score in scores_numbers_ranked]
 
-    def rerank_candidates(self,q,candidates,approach='ensemble'):
+    def retrieve_candidates_batch(self,questiontokens,n,version=False,retriever='bm25'):
+        """
+        Function to retrieve candidate similar questions for several questions (lists of word tokens) at once,
+            as retrieve_candidates does for each of them, with the BM25 scores of all questions computed in one pass over the index
+        """
+        version = self.retriever_version(version,retriever)
+        if retriever == 'bm25':
+            ranked = version.bm25.return_top_batch(questiontokens,n)
+        elif retriever == 'dense':
+            ranked = [version.dense.search(self.question_vector(tokens),n) for tokens in questiontokens]
+        else:
+            ranked = [self.hybrid_top(bm25_ranked,tokens,n,version) for bm25_ranked,tokens in zip(version.bm25.return_top_batch(questiontokens,2*n),questiontokens)]
+        return [[self.questions[i] for i,score in scores_numbers_ranked] for scores_numbers_ranked in ranked]
+
+    def retriever_version(self,version,retriever):
+        """
+        Function to return the given version of the index (by default the current version) to retrieve candidates from,
+            after initializing the dense index if the retriever needs it and its initialization was postponed
+        Raises a ValueError if the retriever needs the dense index and the version has none
+        """
+        if retriever != 'bm25':
+            self.require('dense')
+        version = version if version else self.version
+        if retriever != 'bm25' and version.dense is False:
+            raise ValueError('The ' + str(retriever) + ' retriever needs the dense index, which is not initialized (see init_dense)')
+        return version
+
+    def hybrid_top(self,bm25_ranked,questiontokens,n,version):
+        """
+        Function to combine the questions ranked by BM25 with those ranked by the dense index by reciprocal rank fusion
+        Twice as many questions as requested are ranked by both retrievers, and only questions with a positive BM25 score are included,
+            as BM25 fills up its ranking with unmatched questions
+        """
+        dense_ranked = version.dense.search(self.question_vector(questiontokens),2*n)
+        return reciprocal_rank_fusion([[x for x in bm25_ranked if x[1] > 0],dense_ranked],n)
+
+    def prepare_embeddings(self,q,candidates):
+        # make sure that a question and its candidates are encoded
+        if len(q.emb) == 0:
+            q.set_emb(self.encode(q.tokens))
+        for c in candidates:
+            if len(c.emb) == 0:
+                c.set_emb(self.encode(c.tokens))
+
+    def rerank_candidates(self,q,candidates,approach='ensemble',version=False):
         """
         Function to rerank a set of candidate similar questions to given questions, based on a chosen model 
+        BM25 scores are computed with the given version of the index (by default the current version), 
+            which should include the candidates
         """
         candidate_score = []
+        if len(candidates) == 0:
+            return candidate_score
+        version = version if version else self.version
         if approach == 'bm25':
-            for candidate in candidates:
-                candidate_score.append([candidate,self.gv_bm25.return_score(q,self.id2q[candidate.id])])
+            scores = version.bm25.return_score_batch(q,[self.id2q[c.id] for c in candidates])
+            candidate_score = [[candidate,score] for candidate,score in zip(candidates,scores.tolist())]
         else:
-            if len(q.emb) == 0:
-                q.set_emb(self.encode(q.tokens))
-            for c in candidates:
-                if len(c.emb) == 0:
-                    c.set_emb(self.encode(c.tokens))
+            self.prepare_embeddings(q,candidates)
+            self.require(approach)
             if approach == 'trlm':
-                for candidate in candidates:
-                    candidate_score.append([candidate,self.trlm.apply_model(q,candidate)])
+                scores = self.trlm.apply_model_batch(q,candidates)
+                candidate_score = [[candidate,score] for candidate,score in zip(candidates,scores)]
             elif approach == 'softcosine':
-                for candidate in candidates:
-                    candidate_score.append([candidate,self.softcosine.apply_model(q,candidate)])
+                scores = self.softcosine.apply_model_batch(q,candidates,[self.id2q[c.id] for c in candidates])
+                candidate_score = [[candidate,score] for candidate,score in zip(candidates,scores)]
             elif approach == 'ensemble':
-                for candidate in candidates:
-                    candidate_score.append([candidate] + self.qsim(q,candidate))
+                output = self.ensemble.apply_model_batch(self.return_scores_batch(q,candidates,version))
+                candidate_score = [[candidate] + o for candidate,o in zip(candidates,output)]
         return sorted(candidate_score,key = lambda k : k[1],reverse = True)
+
+    def rerank_candidates_batch(self,questions,candidates,approach='ensemble',version=False):
+        """
+        Function to rerank the candidates of several questions at once (a list of candidates per question), 
+            with the same outcome as rerank_candidates for each of them
+        With the ensemble model, the similarity scores of all questions and their candidates are classified in one call
+        """
+        version = version if version else self.version
+        if approach != 'ensemble':
+            return [self.rerank_candidates(q,c,approach,version) for q,c in zip(questions,candidates)]
+        self.require('ensemble')
+        vectors = []
+        for q,c in zip(questions,candidates):
+            if len(c) > 0:
+                self.prepare_embeddings(q,c)
+                vectors.append(self.return_scores_batch(q,c,version))
+        output = self.ensemble.apply_model_batch(np.vstack(vectors)) if len(vectors) > 0 else []
+        ranked, start = [], 0
+        for c in candidates:
+            candidate_score = [[candidate] + o for candidate,o in zip(c,output[start:start+len(c)])]
+            ranked.append(sorted(candidate_score,key = lambda k : k[1],reverse = True))
+            start += len(c)
+        return ranked
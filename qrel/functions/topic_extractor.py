@@ -1,51 +1,116 @@
 
-import copy
 import numpy
 
+from qrel.classes import snapshot, ngram_matcher
+
+class Scratch:
+    """
+    Class with the intermediate data structures of topic extraction, 
+    which are emptied and reused for each question when topics are extracted from many questions
+    The ids of the lemmas in the matcher are kept for all questions, as lemmas recur across questions
+    """
+    def __init__(self):
+        self.positions = {} # topic segment (single word or n-gram of lemmas) -> [start,end] of its first occurrence in the question
+        self.indices = {} # topic segment -> its index in the tables
+        self.scores = {} # topic segment -> [commonness score, entropy score]
+        self.token_ids = {} # lemma -> its id in the matcher
+
+    def clear(self):
+        self.positions.clear()
+        self.indices.clear()
+        self.scores.clear()
+
 class TopicExtractor:
     """
     Class to extract topic segments from a given (Dutch) text, 
     using pre-trained models from Wikipedia and the GoeieVraag.nl categories
     """
-    def __init__(self,ngram_commonness,ngram_entropy):
-        # initialize with pretrained models (e.g.: lists with topic segments and their prominence score)
+    def __init__(self,ngram_commonness,ngram_entropy,tablespath=False):
+        """
+        initialize with pretrained models (e.g.: lists with topic segments and their prominence score)
+        The models are compiled into tables: an automaton to find the topic segments in a question, and arrays with their scores
+        If a tablespath is given, the tables are written to this file the first time (or when the models have changed), 
+            and opened with numpy.memmap afterwards, so that processes share a single copy of them
+        """
+        self.matcher = ngram_matcher.NgramMatcher()
+        self.cs = numpy.zeros(0) # index of topic segment in the matcher -> commonness score (nan if it has none)
+        self.entropy = numpy.zeros(0) # index of topic segment in the matcher -> inverted entropy score (nan if it has none)
+        if tablespath:
+            tables = snapshot.Snapshot(tablespath,{'commonness':ngram_commonness,'entropy':ngram_entropy})
+            if tables.load() and tables.fresh(['commonness','entropy']):
+                print('Opening topic tables',tablespath)
+                self.restore(tables.component('topics'))
+                return
         print('Initializing commonness')
-        self.set_commonness(ngram_commonness)
+        cs = self.read_commonness(ngram_commonness)
         print('Initializing entropy')
-        self.set_entropy(ngram_entropy)
+        entropy = self.read_entropy(ngram_entropy)
+        print('Compiling topic tables')
+        self.set_tables(cs,entropy)
+        if tablespath:
+            print('Writing topic tables to',tablespath)
+            tables.write({'topics':self.export()})
+            tables.load()
+            self.restore(tables.component('topics'))
 
     ############
     ### INIT ###
     ############
 
-    def set_commonness(self,ngram_commonness):
+    def read_commonness(self,ngram_commonness):
         """
-        Initialize commonness scores of topic segments - titles of wikipedia pages and their commonness score
+        Read commonness scores of topic segments - titles of wikipedia pages and their commonness score
         The score is based on how often (relatively) the title of the page is used as a hyperlink from other pages
         """
-        self.cs = {} # dictionary with ngram string as key and commonness score as value
+        cs = {} # dictionary with ngram string as key and commonness score as value
         with open(ngram_commonness,'r',encoding='utf-8') as file_in:
-            lines = file_in.read().strip().split('\n')
-            for line in lines:
-                tokens = line.split('\t')
+            for line in file_in:
+                if len(line.strip()) == 0:
+                    continue
+                tokens = line.rstrip('\n').split('\t')
                 entity = tokens[0]
-                self.cs[entity] = float(tokens[-1])
-        self.commonness_set = set(self.cs.keys())
+                cs[entity] = float(tokens[-1])
+        return cs
 
-    def set_entropy(self,ngram_entropy):
+    def read_entropy(self,ngram_entropy):
         """
-        Initialize entropy scores of topic segments - 
+        Read entropy scores of topic segments - 
         the link between lemma ngrams in questions posed on goeievraag.nl with particular question categories 
         --> the more an ngram is used across different categories, the higher its entropy, and the lower its prominence as a topic ngram
         """
-        self.entropy = {} # dictionary with ngram string as key and inverted entropy score as value 
+        entropy = {} # dictionary with ngram string as key and inverted entropy score as value 
         with open(ngram_entropy,'r',encoding='utf-8') as file_in:
-            lines = file_in.read().strip().split('\n')
-            for line in lines:
+            for line in file_in:
                 tokens = line.split()
+                if len(tokens) == 0:
+                    continue
                 entity = ' '.join(tokens[:-1])
-                self.entropy[entity] = 1 - float(tokens[-1])
-        self.entropy_set = set(self.entropy.keys())
+                entropy[entity] = 1 - float(tokens[-1])
+        return entropy
+
+    def set_tables(self,cs,entropy):
+        """
+        Compile the commonness and entropy scores into an automaton that finds the topic segments of both models 
+        (single words and multi-word n-grams) in a question, and arrays with the scores of each topic segment
+        """
+        self.matcher = ngram_matcher.NgramMatcher(list(cs.keys()) + list(entropy.keys()))
+        ngrams = [self.matcher.ngrams[i] for i in range(len(self.matcher))]
+        self.cs = numpy.array([cs.get(ngram,numpy.nan) for ngram in ngrams])
+        self.entropy = numpy.array([entropy.get(ngram,numpy.nan) for ngram in ngrams])
+
+    def export(self):
+        # return the tables as a dictionary of arrays, to store them in a file
+        arrays = {'commonness':self.cs,'entropy':self.entropy}
+        for name,array in self.matcher.export().items():
+            arrays['matcher_' + name] = array
+        return arrays
+
+    def restore(self,arrays):
+        # restore the tables stored in a file, without copying them
+        self.cs = arrays['commonness']
+        self.entropy = arrays['entropy']
+        self.matcher = ngram_matcher.NgramMatcher()
+        self.matcher.restore(dict([(name[len('matcher_'):],array) for name,array in arrays.items() if name.startswith('matcher_')]))
 
     ###############
     ### HELPERS ###
@@ -57,10 +122,13 @@ class TopicExtractor:
         index = sequence1.index(token)
         return sequence2[index]
 
-    def filter_entities(self,entities,question):
+    def filter_entities(self,entities,question,positions=False):
         # function to remove topic segments that are likely uninformative
         # topic segments that are no Noun, Verb, Adverb or Adjective are arguably too uninformative
+        # if the positions of the topic segments in the question are given ([start,end] of each), these are used to find their postag
         filtered = []
+        postags = question.pos
+        lemmas = question.lemmas
         for entity in entities:
             tokens = entity.split()
             if len(tokens) > 1: # topic segments with multiple tokens are often informative 
@@ -70,74 +138,70 @@ class TopicExtractor:
                 if len(entity) <= 1:
                     continue
                 try:
-                    pos = self.match_index(entity,question.lemmas,question.pos)
+                    pos = postags[positions[entity][0]] if positions else self.match_index(entity,lemmas,postags)
                     if not pos in ['DET','PRON','ADP','ADV','CCONJ','SCONJ','CONJ']: # check for postag
                         filtered.append(entity)
                 except:
-                    print('COULD NOT FIND INDEX FOR',entity.encode('utf-8'),'in',' '.join(question.lemmas).encode('utf-8'))
+                    print('COULD NOT FIND INDEX FOR',entity.encode('utf-8'),'in',' '.join(lemmas).encode('utf-8'))
                     continue
         return filtered
 
-    def rerank_topics(self,topics_commonness,topics_entropy):
+    def rerank_topics(self,topics_commonness,topics_entropy,scores=False):
         """ 
         Function to combine commonness and entropy scores for topic segments into a single score
         The two metrics differ in which topic segments they include and how much weight those are given
-
-
+        The scores are merged in a single pass over both lists, in a dictionary (scores, which is reused if given)
         """
-        topics_commonness_txt = [x[0] for x in topics_commonness]
-        topics_entropy_txt = [x[0] for x in topics_entropy]
-        topics_commonness_only = list(set(topics_commonness_txt) - set(topics_entropy_txt))
-        topics_entropy_only = list(set(topics_entropy_txt) - set(topics_commonness_txt))
-        topics_union = list(set(topics_commonness_txt).union(set(topics_entropy_txt)))
-        topics_commonness_complete = copy.deepcopy(topics_commonness)
-        for topic in topics_entropy_only:
-            topics_commonness_complete.append([topic,0]) # the entropy topics that are not scored with commonness are appended with '0' for commonness 
-        topics_entropy_complete = copy.deepcopy(topics_entropy)
-        for topic in topics_commonness_only:
-            topics_entropy_complete.append([topic,0]) # the commonness topics that are not scored with entropy are appended with '0' for entropy
-        topics_commonness_complete_txt = [x[0] for x in topics_commonness_complete]
-        topics_entropy_complete_txt = [x[0] for x in topics_entropy_complete]
-        topics_combined = []
-        for topic in topics_union:
-            score_commonness = topics_commonness_complete[topics_commonness_complete_txt.index(topic)][1]
-            score_entropy = topics_entropy_complete[topics_entropy_complete_txt.index(topic)][1]
-            avg = numpy.mean([score_commonness,score_entropy]) # the topics that are scored by both metrics are scored as the average of the two
-            topics_combined.append([topic,avg,score_entropy,score_commonness])
+        scores = scores if scores is not False else {}
+        for topic,score in topics_commonness:
+            scores[topic] = [score,0]
+        for topic,score in topics_entropy:
+            if topic in scores:
+                scores[topic][1] = score
+            else:
+                scores[topic] = [0,score] # the entropy topics that are not scored with commonness are given '0' for commonness
+        # the topics that are scored by both metrics are scored as the average of the two, the others are given '0' for the missing metric
+        topics_combined = [[topic,(score_commonness + score_entropy) / 2,score_entropy,score_commonness] for topic,(score_commonness,score_entropy) in scores.items()]
         topics_ranked = sorted(topics_combined,key = lambda k : k[1],reverse=True) # rank topics by combined score
         return topics_ranked
 
-    def reduce_overlap(self,ranked_topics):
+    def reduce_overlap(self,ranked_topics,max_topics=False):
         """
         Function to reduce overlap in topics segments
         Some topics segments are redundant to each other when they partly overlap
         In this case the topic segment with the lower score of the two is removed
+        The words of the placed topic segments are tracked in a single set; if max_topics is given, 
+            the function returns as soon as that many topic segments are placed
         """
         filtered_topics = []
+        placed = set() # words of the placed topic segments
         for topic in ranked_topics:
-            overlap = False
-            for j,placed_topic in enumerate(filtered_topics):
-                if set(topic[0].split()) & set(placed_topic[0].split()):
-                    overlap = True
-                    break
-            if not overlap:
+            if max_topics and len(filtered_topics) == max_topics:
+                break
+            words = topic[0].split()
+            if placed.isdisjoint(words):
                 filtered_topics.append(topic)
+                placed.update(words)
         return filtered_topics
 
-    def topic2text(self,topics,question):
+    def topic2text(self,topics,question,positions=False):
         """
         Topic segments are extracted as a sequence of lemma's, 
         which is not insightful to present the particular topic segment for a given question
         This function returns the actual words of the topic in the question as a string, 
-        based on the position of the lemmas in the question
+        based on the position of the lemmas in the question (given as [start,end] of each topic, or searched for)
         """
+        qtokens = question.tokens # decoded once, the properties return a new list on every read
+        if positions:
+            return [' '.join(qtokens[positions[topic][0]:positions[topic][1]]) for topic in topics]
+        lemmas = question.lemmas
         topics_text = []
         for topic in topics:
             tokens = topic.split()
             if len(tokens) > 1:
                 startindices = []
                 for i in range(len(tokens)):
-                    indices = [j for j,x in enumerate(question.lemmas) if x == tokens[i]]
+                    indices = [j for j,x in enumerate(lemmas) if x == tokens[i]]
                     if len(startindices) == 0:
                         startindices = indices
                     else:
@@ -150,12 +214,12 @@ class TopicExtractor:
                             print("could not find indices for",topic,sequence)
                         startindices = new_startindices
                 if not len(startindices) == 1:
-                    print("No single start index for",topic.encode('utf-8'),' '.join([x[0] for x in question.lemmas]).encode('utf-8'),"startindex",startindices)
+                    print("No single start index for",topic.encode('utf-8'),' '.join([x[0] for x in lemmas]).encode('utf-8'),"startindex",startindices)
                 index = startindices[0] - len(tokens)
-                text = ' '.join(question.tokens[startindices[0]-1:startindices[0]+(len(tokens)-1)])
+                text = ' '.join(qtokens[startindices[0]-1:startindices[0]+(len(tokens)-1)])
             else:
                 entity = tokens[0]
-                text = question.tokens[question.lemmas.index(entity)]
+                text = qtokens[lemmas.index(entity)]
             topics_text.append(text)
         return topics_text
     
@@ -163,7 +227,7 @@ class TopicExtractor:
     ### EXTRACT ###
     ###############
 
-    def extract(self,question,max_topics=5):
+    def extract(self,question,max_topics=5,scratch=False):
         """
         Function to apply all steps of topic extraction to a given question, and return a ranked list of:
         - extracted topic (sequence of lemmas)
@@ -171,16 +235,28 @@ class TopicExtractor:
         - particular commonness score of topic
         - particular entropy score of topic
         - topic as it occurs in the given question
+        The intermediate data structures are taken from scratch if it is given (see extract_list)
         """
-        topics_commonness = [[e,self.cs[e]] for e in self.filter_entities(list(set(question.lemmas) & self.commonness_set),question) if self.cs[e] > 0.05]
-        topics_entropy = [[e,self.entropy[e]] for e in self.filter_entities(list(set(question.lemmas) & self.entropy_set),question)]
-        topics_ranked = self.rerank_topics(topics_commonness,topics_entropy)
-        topics_filtered = self.reduce_overlap(topics_ranked)[:max_topics]
-        topics_text = self.topic2text([x[0] for x in topics_filtered],question)
+        scratch = scratch if scratch else Scratch()
+        scratch.clear()
+        positions, indices = scratch.positions, scratch.indices
+        for i,start,end in self.matcher.match(question.lemmas,scratch.token_ids):
+            ngram = self.matcher.ngrams[i]
+            indices[ngram] = i
+            if ngram not in positions or start < positions[ngram][0]:
+                positions[ngram] = [start,end]
+        commonness = dict([(e,float(self.cs[i])) for e,i in indices.items() if not numpy.isnan(self.cs[i])])
+        entropy = dict([(e,float(self.entropy[i])) for e,i in indices.items() if not numpy.isnan(self.entropy[i])])
+        topics_commonness = [[e,commonness[e]] for e in self.filter_entities(list(commonness.keys()),question,positions) if commonness[e] > 0.05]
+        topics_entropy = [[e,entropy[e]] for e in self.filter_entities(list(entropy.keys()),question,positions)]
+        topics_ranked = self.rerank_topics(topics_commonness,topics_entropy,scratch.scores)
+        topics_filtered = self.reduce_overlap(topics_ranked,max_topics)
+        topics_text = self.topic2text([x[0] for x in topics_filtered],question,positions)
         topics_filtered_text = [tf + [topics_text[i]] for i,tf in enumerate(topics_filtered)]
         topics_filtered_text_dict = [{'topic':x[0],'topic_score':x[1],'topic_entropy':x[2],'topic_commonness':x[3],'topic_text':x[4]} for x in topics_filtered_text]
         return topics_filtered_text_dict
 
     def extract_list(self,questions,max_topics=5):
-        # Function to extract topics from multiple questions
-        return [self.extract(q,max_topics) for q in questions]
+        # Function to extract topics from multiple questions, reusing the intermediate data structures across questions
+        scratch = Scratch()
+        return [self.extract(q,max_topics,scratch) for q in questions]
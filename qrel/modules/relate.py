@@ -3,7 +3,7 @@
 #author          :Florian Kunneman, Thiago Castro Ferreira
 #date            :20190809
 #version         :0.1
-#usage           :python relate.py test; python relate.py test_many; python relate.py [new_questions.json]
+#usage           :python relate.py test; python relate.py test_many; python relate.py termsim; python relate.py snapshot; python relate.py topics; python relate.py dense; python relate.py export; python relate.py [new_questions.json]
 #notes           : 
 #python_version  :3.5.2  
 #==============================================================================
@@ -12,26 +12,36 @@ import os
 import sys
 import json
 import warnings
+import threading
+import functools
 
 import numpy
 import spacy
 from gensim.corpora import Dictionary
-from gensim.models import TfidfModel, Word2Vec
+from gensim.models import TfidfModel, Word2Vec, KeyedVectors
 
-from qrel.classes import question
-from qrel.functions import qsim, qrel, topic_extractor
+from qrel.classes import question, question_store, encoder, termsim, loader, snapshot, cache, refresh_queue
+from qrel.functions import qsim, qrel, topic_extractor, parallel
 
 script_dir = os.path.dirname(__file__)
 questionspath = script_dir + '/../../data/questions.json'
+questionslogpath = script_dir + '/../../data/questions.log.jsonl'
 related_questionspath = script_dir + '/../../data/questions.related.json'
 training_questionspath = script_dir + '/../../data/training_questions.json'
 dictpath = script_dir + '/../../data/dict.model'
+termsimpath = script_dir + '/../../data/termsim.npz'
 w2vpath = script_dir + '/../../data/word2vec.300_10.model'
+vectorspath = script_dir + '/../../data/word2vec.300_10.kv'
+embeddingspath = script_dir + '/../../data/embeddings'
 tfidfpath = script_dir + '/../../data/tfidf.model'
 trlmpath = script_dir + '/../../data/trlm.json'
 ensemblepath = script_dir + '/../../data/ensemble.pkl'
 commonness_path = script_dir + '/../../data/commonness_ngrams.txt'
 entropy_path = script_dir + '/../../data/entropy_ngrams.txt'
+snapshotpath = script_dir + '/../../data/snapshot.bin'
+topicspath = script_dir + '/../../data/topics.bin'
+densepath = script_dir + '/../../data/dense.bin'
+spacy_model = 'nl_core_news_sm'
 
 warnings.filterwarnings("ignore")
 
@@ -41,36 +51,94 @@ class Relate:
         repo to update and maintain a database of related questions
     """
 
-    def __init__(self):
+    def __init__(self,lazy=True,cachesize=10000,cachepath=False,refresh_budget=0.25,refresh_priority='staleness',resultsize=10000,result_ttl=3600,max_stale=0,
+        retriever='bm25',dense_weighting='tfidf'):
         """
         All relevant models are initialized based on the file paths specified above of this class
+        Models that do not depend on each other are loaded in parallel; 
+            if lazy is True, the TRLM, SoftCosine and ensemble models are only loaded when they are first used
+        The preprocessing and encoding of new question texts is cached for the cachesize most recently used texts,
+            and in an sqlite database on disk if a cachepath is given
+        The most similar questions to a question text are cached for the resultsize most recently asked texts and models, 
+            for at most result_ttl seconds; once questions are added they are computed again, 
+            unless the index has changed at most max_stale times since they were cached
+        Candidate related questions are retrieved by BM25, by a dense index of question vectors (averaged word embeddings, 
+            weighted by their idf if dense_weighting is 'tfidf') or by both (retriever 'bm25', 'dense' or 'hybrid')
+        Questions of which the related questions might have changed by an added question are refreshed by a refresh queue,
+            in a background thread that uses at most refresh_budget of one core (see start_refresher)
         """
         self.questions = []
         self.candidates = []
+        self.nlp = False
         self.qs = False
         self.topex = False
         self.qr = False
-
-        self.nlp = spacy.load('nl_core_news_sm')
-        self.nlp.disable_pipes('parser','ner')
-        self.load_questions()
-        self.init_topex()
+        self.store = question_store.QuestionStore(questionspath,questionslogpath)
+        self.snapshot = snapshot.Snapshot(snapshotpath,{'dictionary':dictpath,'tfidf':tfidfpath,'word2vec':w2vpath,'termsim':termsimpath,
+            'ensemble':ensemblepath})
+        self.snapshot_matches = False # whether the snapshot was built from (the first part of) the current questions
+        self.retriever = retriever
+        self.dense_weighting = dense_weighting
+        self.dense_snapshot = snapshot.Snapshot(densepath,{'dictionary':dictpath,'tfidf':tfidfpath,'word2vec':w2vpath})
+        self.cache = cache.LRUCache(cachesize,cachepath,json.dumps([spacy_model,snapshot.file_signature(dictpath),snapshot.file_signature(w2vpath)]))
+        self.results = cache.ResultCache(resultsize,result_ttl,max_stale)
+        self.refresher = refresh_queue.RefreshQueue(self.refresh,budget=refresh_budget,priority=refresh_priority)
+        self.lock = threading.RLock() # guards changes to the questions and the files they are written to
+
+        self.loader = loader.Loader()
+        self.loader.register('snapshot',self.load_snapshot)
+        self.loader.register('spacy',self.load_nlp)
+        self.loader.register('questions',self.load_questions)
+        self.loader.register('topics',self.init_topex)
+        self.loader.register('dictionary',lambda : Dictionary.load(dictpath))
+        self.loader.register('word2vec',load_word2vec)
+        self.loader.register('tfidf',lambda : TfidfModel.load(tfidfpath))
+        self.loader.start(['snapshot','spacy','questions','topics','dictionary','word2vec','tfidf'])
+        self.loader.wait(['spacy','questions','topics'])
         self.prepare_questions()
-        self.init_qsim()
+        self.init_qsim(lazy)
         self.init_qrel()
+        self.loader.report()
 
     ############
     ### INIT ###
     ############
 
+    def load_snapshot(self):
+        # open the snapshot with the prebuilt serving state, if it exists
+        if self.snapshot.load():
+            print('Opened snapshot',snapshotpath)
+        else:
+            print('No snapshot in',snapshotpath,'(or outdated format), building all models from their files')
+        return self.snapshot
+
+    def stored(self,component,sources=[],questions=True):
+        """
+        Function to return the arrays of a component in the snapshot, or False if the snapshot does not contain it or it is stale:
+            if one of the given source files changed since the snapshot was written, 
+            or if the component depends on the questions and the snapshot was not built from the current questions
+        """
+        self.loader.get('snapshot')
+        if not self.snapshot.contains(component) or not self.snapshot.fresh(sources) or (questions and not self.snapshot_matches):
+            return False
+        return self.snapshot.component(component)
+
+    def load_nlp(self):
+        # load the spacy model for preprocessing
+        print('Loading spacy')
+        self.nlp = spacy.load(spacy_model)
+        self.nlp.disable_pipes('parser','ner')
+        return self.nlp
+
     def load_questions(self,qpath=questionspath):
         # read in questions
         if os.path.exists(qpath): # make sure that file in path exists
             print('Loading questions')
-            with open(qpath, 'r', encoding = 'utf-8') as file_in:
-                questiondicts = json.loads(file_in.read())
-            print('Formatting questions')
-            # format as question objects
+            if qpath == questionspath: # questions in the store, including those added or changed since the file was written
+                questiondicts = self.store.iterate()
+            else:
+                questiondicts = question_store.iterate_json(qpath)
+            # format as question objects, while the file is streamed
             for qd in questiondicts:
                 qobj = question.Question()
                 qobj.import_qdict(qd)
@@ -83,58 +151,131 @@ class Relate:
     def init_topex(self):
         # initialize topic extractor 
         print('Initializing topic extractor')
-        self.topex = topic_extractor.TopicExtractor(commonness_path,entropy_path)
+        self.topex = topic_extractor.TopicExtractor(commonness_path,entropy_path,topicspath)
+        return self.topex
 
-    def prepare_questions(self,index=0):
-        # prepare questions - make sure they are preprocessed and their topics are extracted
-        if not self.questions[index].lemmas: # rudimental check if preprocessing has already been done
+    def prepare_questions(self,index=0,batch_size=1000,n_process=1):
+        """
+        prepare questions - make sure they are preprocessed and their topics are extracted
+        Questions are preprocessed in batches of batch_size, and both steps are run in n_process processes
+        """
+        questions = self.questions[index:]
+        if not questions[0].lemmas: # rudimental check if preprocessing has already been done
             print('Preprocessing questions, this may take a while...')
-            counter = range(0,len(self.questions)-index,100)
-            for i,q in enumerate(self.questions[index:]):
-                if i in counter:
-                    print('Question',i,'of',len(self.questions)-index,'(counting per 100)')
-                q.preprocess(self.nlp)
-            self.save()
-        if not self.questions[index].topics: # rudimental step to check if topics have been extracted
+            progress = parallel.Progress('Preprocessed questions',len(questions))
+            for q in question.preprocess_questions(questions,self.nlp,batch_size,n_process):
+                progress.update(1)
+            self.save(questions)
+        if not questions[0].topics: # rudimental step to check if topics have been extracted
             print('Extracting topics from questions, this may take a while...')
-            counter = range(0,len(self.questions)-index,100)
-            for i,q in enumerate(self.questions[index:]):
-                if i in counter:
-                    print('Question',i,'of',len(self.questions)-index,'(counting per 100)')
-                q.set_topics(self.topex.extract(q))
-            self.save()
+            # worker processes are forked with the topic extractor, of which the tables are shared as a memory map
+            topics = parallel.map_chunks(lambda start,end : self.topex.extract_list(questions[start:end]),len(questions),n_process,label='Extracted topics')
+            for q,t in zip(questions,topics):
+                q.set_topics(t)
+            self.save(questions)
                 
-    def init_qsim(self,bm25only=False):
-        # initialize qsim
-
-        # fast init
-        if bm25only:
-            self.qs.questions = self.questions
-            self.qs.init_bm25()
-            self.qs.id2q = self.qs.id2question()
-        # complete init
-        else:
-            # load models needed for initialization of qsim
-            d = Dictionary.load(dictpath)
-            word2vec = Word2Vec.load(w2vpath)
-            tfidf = TfidfModel.load(tfidfpath)
-            self.qs = qsim.QSim(self.questions,d,tfidf,word2vec)
-            # initialize separate components of qsim
-            print('Initializing BM25')
-            self.qs.init_bm25()
-            print('Initializing TRLM')
-            self.qs.init_trlm(trlmpath)
-            print('Initializing SoftCosine')
-            self.qs.init_softcosine()
-            print('Initializing Ensemble')
-            self.qs.init_ensemble(ensemblepath,training_questionspath)
+    def init_qsim(self,lazy=True):
+        """
+        initialize qsim
+        BM25 and the embeddings are initialized right away, as they are needed to retrieve candidates and encode questions;
+            the other components are initialized in parallel, or on their first use if lazy is True
+        """
+        # load models needed for initialization of qsim
+        d = self.loader.get('dictionary')
+        word2vec = self.loader.get('word2vec')
+        tfidf = self.loader.get('tfidf')
+        self.qs = qsim.QSim(self.questions,d,tfidf,word2vec)
+        self.loader.get('snapshot')
+        self.snapshot_matches = self.snapshot.matches(self.questions)
+        # initialize separate components of qsim
+        print('Initializing BM25')
+        self.qs.init_bm25(self.stored('bm25'))
+        print('Initializing embeddings')
+        self.qs.init_embeddings(embeddingspath,{'dictionary':dictpath,'word2vec':w2vpath})
+        self.loader.register('dense',self.init_dense)
+        self.qs.defer('dense',functools.partial(self.loader.get,'dense'))
+        if self.retriever != 'bm25':
+            self.loader.get('dense')
+        self.loader.register('termsim',self.init_termsim)
+        self.loader.register('trlm',self.init_trlm)
+        self.loader.register('softcosine',self.init_softcosine)
+        self.loader.register('ensemble',self.init_ensemble)
+        for component in ['trlm','softcosine','ensemble']:
+            self.qs.defer(component,functools.partial(self.loader.get,component))
+        if not lazy:
+            self.loader.start(['trlm','softcosine','ensemble'])
+            self.loader.wait(['trlm','softcosine','ensemble'])
+
+    def init_termsim(self):
+        print('Initializing term similarities')
+        self.qs.init_termsim(termsimpath)
+        return self.qs.termsim
+
+    def init_trlm(self):
+        self.loader.get('termsim')
+        print('Initializing TRLM')
+        self.qs.init_trlm(trlmpath)
+        return self.qs.trlm
+
+    def init_softcosine(self):
+        self.loader.get('termsim')
+        print('Initializing SoftCosine')
+        self.qs.init_softcosine(self.stored('softcosine',['dictionary','tfidf','word2vec','termsim']))
+        return self.qs.softcosine
+
+    def init_ensemble(self):
+        print('Initializing Ensemble')
+        self.qs.init_ensemble(ensemblepath,training_questionspath,self.stored('ensemble',['ensemble'],questions=False))
+        return self.qs.ensemble
+
+    def init_dense(self):
+        """
+        Function to initialize the dense index of question vectors, restored from its file if it was built from the current questions 
+            (or the first part of them) and model files, and built and written to its file otherwise
+        It is initialized right away if the 'dense' or 'hybrid' retriever is used, and on its first use otherwise;
+            questions are not added in the meantime, so that none of them is missing from the index
+        """
+        print('Initializing dense index')
+        component = 'dense_' + self.dense_weighting
+        with self.lock:
+            stored = False
+            if self.dense_snapshot.load() and self.dense_snapshot.fresh(['dictionary','tfidf','word2vec']):
+                if self.dense_snapshot.contains(component) and self.dense_snapshot.matches(self.questions):
+                    stored = self.dense_snapshot.component(component)
+            self.qs.init_dense(stored,self.dense_weighting)
+            if not stored:
+                self.write_dense()
+        return self.qs.dense
 
     def init_qrel(self):
         # initialize question relator
         print('Initializing question relator')
-        self.qr = qrel.QuestionRelator(self.qs)
+        self.qr = qrel.QuestionRelator(self.qs,self.retriever)
 
 
+    def write_snapshot(self):
+        """
+        Function to write the built serving state (BM25 index, question ids, tfidf vectors and softcosine norms 
+            and ensemble coefficients) to the snapshot, from which it is restored the next time the system is initialized
+        The embeddings of the questions and the topic tables are not included, as they are stored in memory-mapped files of their own
+        """
+        self.qs.require('softcosine','ensemble')
+        print('Writing snapshot to',snapshotpath)
+        self.snapshot.write({
+            'questions':snapshot.question_arrays(self.questions),
+            'bm25':self.qs.gv_bm25.export(),
+            'softcosine':self.qs.softcosine.export(),
+            'ensemble':self.qs.ensemble.export()
+        })
+
+    def write_dense(self):
+        # write the dense index of question vectors to its file, with the ids of the questions in it
+        print('Writing dense index to',densepath)
+        self.dense_snapshot.write({
+            'questions':snapshot.question_arrays(self.questions[:len(self.qs.dense)]),
+            'dense_' + self.dense_weighting:self.qs.dense.export()
+        })
+
     ##############
     ### RELATE ###
     ##############
@@ -149,8 +290,7 @@ class Relate:
         q = question.Question()
         q.questiontext = qtext
         q.id = qid
-        q.preprocess(self.nlp)
-        q.set_emb(self.qs.encode(q.tokens))
+        self.analyze(q)
         q.set_topics(self.topex.extract(q))
 
         # retrieve related questions
@@ -162,80 +302,244 @@ class Relate:
         
         return {'questiontext':qtext,'qid':qid,'related':related}
 
+    def relate_batch(self,requests):
+        """
+        Model call by which related questions are retrieved for several questions at once (a list of [question text, question id,
+            number of candidates]), with the same outcome as calling the model for each of them; the dataset is updated with all of them
+        The question texts are preprocessed in one call of nlp.pipe, and their candidates are retrieved and scored together
+        """
+        return self.commit_batch(self.score_batch(requests))
+
+    def score_batch(self,requests):
+        """
+        Function to retrieve related questions for several questions at once (see relate_batch), without updating the dataset
+        returns a list with each new question (with its related questions) and its candidates, to be added by commit_batch
+        """
+        questions = []
+        for qtext,qid,ncandidates in requests:
+            q = question.Question()
+            q.questiontext = qtext
+            q.id = qid
+            questions.append(q)
+        self.analyze_batch(questions)
+        for q,topics in zip(questions,self.topex.extract_list(questions)):
+            q.set_topics(topics)
+
+        # retrieve related questions, together for the questions with the same number of candidates
+        candidates = [False] * len(questions)
+        for ncandidates in set([r[2] for r in requests]):
+            indices = [i for i,r in enumerate(requests) if r[2] == ncandidates]
+            for i,(related,c) in zip(indices,self.qr.relate_questions([questions[i] for i in indices],ncandidates=ncandidates)):
+                questions[i].set_related(related)
+                candidates[i] = c
+        return list(zip(questions,candidates))
+
+    def commit_batch(self,scored):
+        # update the dataset with questions related by score_batch, and return the output of each of them
+        questions = [q for q,candidates in scored]
+        self.update_many(questions,[c for q,candidates in scored for c in candidates])
+        return [{'questiontext':q.questiontext,'qid':q.id,'related':q.related} for q in questions]
+
+    def analyze(self,q):
+        """
+        Function to preprocess and encode a new question
+        The tokens, lemmas, part-of-speech tags and embeddings are cached by the normalized question text,
+            so that repeated (or only differently spaced) questions are not preprocessed and encoded again
+        """
+        key = cache.normalize(q.questiontext)
+        analysis = self.cache.get(key)
+        if analysis is None:
+            q.preprocess(self.nlp)
+            emb = self.qs.encode(q.tokens)
+            self.cache.put(key,(q.tokens,q.lemmas,q.pos,emb))
+        else:
+            q.tokens, q.lemmas, q.pos, emb = analysis
+        q.set_emb(emb)
+
+    def analyze_batch(self,questions):
+        """
+        Function to preprocess and encode several new questions at once, as analyze does for each of them
+        The questions that are not cached are preprocessed in one call of nlp.pipe
+        """
+        missing = []
+        for q in questions:
+            analysis = self.cache.get(cache.normalize(q.questiontext))
+            if analysis is None:
+                missing.append(q)
+            else:
+                q.tokens, q.lemmas, q.pos, emb = analysis
+                q.set_emb(emb)
+        for q in question.preprocess_questions(missing,self.nlp,max(len(missing),1)):
+            emb = self.qs.encode(q.tokens)
+            self.cache.put(cache.normalize(q.questiontext),(q.tokens,q.lemmas,q.pos,emb))
+            q.set_emb(emb)
+
     def most_similar(self,qtext,model='ensemble'):
         """
         Generic model call by which the most similar questions to a given question are retrieved from the dataset
+        The output is cached by the normalized question text, the model and the version of the index
         """
+        version = self.qs.version
+        key = (cache.normalize(qtext),model)
+        similar = self.results.get(key,version.number)
+        if similar is not None:
+            return {'questiontext':qtext,'similar':similar}
 
         # prepare question object
         q = question.Question()
         q.questiontext = qtext
-        q.preprocess(self.nlp)
-        q.set_emb(self.qs.encode(q.tokens))
+        self.analyze(q)
 
-        # retrieve most similar questions
-        candidates = self.qs.retrieve_candidates(q.tokens,15)
-        similar = self.qs.rerank_candidates(q,candidates,approach=model)
+        # retrieve most similar questions, from one version of the index
+        candidates = self.qs.retrieve_candidates(q.tokens,15,version)
+        similar = self.qs.rerank_candidates(q,candidates,approach=model,version=version)
         
+        output = self.format_similar(qtext,similar,model)
+        self.results.put(key,version.number,output['similar'])
+        return output
+
+    def most_similar_batch(self,requests):
+        """
+        Model call by which the most similar questions are retrieved for several questions at once (a list of [question text, model]),
+            with the same outcome as most_similar for each of them
+        The question texts are preprocessed in one call of nlp.pipe, the candidates of all questions are retrieved in one pass 
+            over the BM25 index and reranked together (in one call of the ensemble model); cached outputs are not computed again
+        """
+        version = self.qs.version
+        output = [False] * len(requests)
+        for i,(qtext,model) in enumerate(requests):
+            similar = self.results.get((cache.normalize(qtext),model),version.number)
+            if similar is not None:
+                output[i] = {'questiontext':qtext,'similar':similar}
+        missing = [i for i in range(len(requests)) if output[i] is False]
+        questions = []
+        for i in missing:
+            q = question.Question()
+            q.questiontext = requests[i][0]
+            questions.append(q)
+        self.analyze_batch(questions)
+
+        # retrieve most similar questions, from one version of the index
+        candidates = self.qs.retrieve_candidates_batch([q.tokens for q in questions],15,version)
+        for model in set([requests[i][1] for i in missing]):
+            indices = [j for j,i in enumerate(missing) if requests[i][1] == model]
+            ranked = self.qs.rerank_candidates_batch([questions[j] for j in indices],[candidates[j] for j in indices],model,version)
+            for j,similar in zip(indices,ranked):
+                qtext = requests[missing[j]][0]
+                output[missing[j]] = self.format_similar(qtext,similar,model)
+                self.results.put((cache.normalize(qtext),model),version.number,output[missing[j]]['similar'])
+        return output
+
+    def format_similar(self,qtext,similar,model):
+        # format the 5 most similar questions as output
         if model == 'ensemble':
             return {'questiontext':qtext, 'similar':[[x[0].id,x[0].questiontext,x[1],int(x[2])] for x in similar[:5]]}
         else:
             return {'questiontext':qtext, 'similar':[[x[0].id,x[0].questiontext,x[1],0] for x in similar[:5]]}
 
-    def relate_many(self,qpath):
+    def relate_many(self,qpath,n_process=1):
         """
         Function to update the dataset with a larger set of questions from a file (specified in qpath)
+        All steps (preprocessing, topic extraction and relating the new questions and the original questions that might need 
+            their related questions updated) are run in n_process processes
         """
         index = len(self.questions) # the current number of questions is stored to prevent redundant computations 
         self.load_questions(qpath) # add questions to current questions
-        self.prepare_questions(index) # if questions do not contain preprocessed and/or topic information, apply these procedures
-        self.init_qsim(bm25only=True) # reinitialize question similarity model with added questions
-        self.init_qrel() # reinitialize question relatedness model with added questions
+        self.prepare_questions(index,n_process=n_process) # if questions do not contain preprocessed and/or topic information, apply these procedures
+        self.qs.update_index() # add the new questions to the question similarity model
         redo = [] # list to store questions in original dataset that might need their related questions updated
         print('Relating new questions, this may take a while...')
-        counter = range(0,len(self.questions)-index,100)
-        for i,q in enumerate(self.questions[index:]):
-            if i in counter:
-                print('Question',i,'of',len(self.questions)-index,'(counting per 100)')
-            related, candidates = self.qr.relate_question(q) # apply question relatedness
+        questions = self.questions[index:]
+        for q,(related,candidates) in zip(questions,self.relate_questions(questions,n_process)):
             q.set_related(related)
             redo.extend(candidates) # store all candidates related to the current question, their question relatedness will be updated later
+        self.save(questions)
         # update related questions for original questions
         self.candidates = [c for c in list(set(redo)) if self.qs.id2q[c] < index]
-        self.update_candidates()
+        self.update_candidates(n_process)
+
+    def relate_questions(self,questions,n_process=1):
+        """
+        Function to apply question relatedness to a list of questions, in n_process processes
+        All models are loaded before the worker processes are forked, so that the workers share the built index with the parent process 
+            (copy-on-write, and through the page cache for memory-mapped arrays) rather than each loading it;
+            the workers relate the questions in chunks and only return the related questions and candidates of each question
+        returns a list with the related questions and candidates of each question
+        """
+        self.qs.require('trlm','softcosine','ensemble')
+        return parallel.map_chunks(lambda start,end : [self.qr.relate_question(q) for q in questions[start:end]],len(questions),n_process,label='Related questions')
         
     def update(self,q,candidates):
         # function to update models with added question
-        self.questions.append(q)
-        self.candidates.extend(candidates)
-        self.init_qsim(bm25only=True) # reinitialize question similarity model with added question
-        self.init_qrel()
+        self.update_many([q],candidates)
+
+    def update_many(self,questions,candidates):
+        # function to update models with added questions
+        with self.lock:
+            self.questions.extend(questions)
+            self.qs.update_index() # add questions to the question similarity model, without reinitializing it
+            self.save(questions)
+        self.refresher.mark(candidates) # the related questions of the candidates are refreshed in the background
 
-    def save(self):
-        # function to write current questions to file
+    def start_refresher(self):
+        # start refreshing the related questions of candidates in a background thread
+        self.refresher.start()
+
+    def refresh(self,ids):
+        """
+        Function to apply question relatedness again to the questions with the given ids, called by the refresh queue
+        The questions are related without holding the lock, so that requests are not stalled; only writing them is locked
+        A question that fails does not stop the others: the questions that succeeded are saved,
+            and the ids of those that failed are returned (to be tried again by the refresh queue)
+        """
+        updated = []
+        failed = []
+        for c in ids:
+            if c not in self.qs.id2q:
+                continue
+            cq = self.questions[self.qs.id2q[c]]
+            try:
+                related, candidates = self.qr.relate_question(cq)
+            except Exception as e:
+                print('Refreshing question',c,'failed:',e)
+                failed.append(c)
+                continue
+            cq.set_related(related)
+            updated.append(cq)
+        if len(updated) > 0:
+            with self.lock:
+                self.save(updated)
+        return failed
+
+    def save(self,questions=False):
+        """
+        function to write questions to file
+        The given questions (added or changed) are appended to the log of the question store;
+            if no questions are given, or the log has grown too long, all questions are written to the legacy json files
+        """
+        if self.qs and self.qs.embeddings is not False: # store embeddings of added questions
+            self.qs.save_embeddings()
+        if questions is not False and len(questions) < self.store.compact_every:
+            self.store.append(questions)
+            if not self.store.needs_compaction():
+                return
         print('Overwriting files with current dataset')
-        extended_questions_json = [q.return_qdict() for q in self.questions]
-        with open(questionspath,'w',encoding='utf-8') as file_out: # store updated questions to file
-            json.dump(extended_questions_json,file_out)
-        try:
-            related_questions_json = [q.return_qdict(short=True) for q in self.questions]
-            with open(related_questionspath,'w',encoding='utf-8') as file_out:
-                json.dump(related_questions_json,file_out)
-        except:
-            pass
+        self.store.compact(self.questions,related_questionspath)
+        if self.qs and self.qs.embeddings is not False: # point all questions to a single map of the stored embeddings
+            self.qs.save_embeddings(remap=True)
+        if self.qs and self.qs.dense is not False: # store the questions added to the dense index
+            self.write_dense()
                 
-    def update_candidates(self):
+    def update_candidates(self,n_process=1):
         print('Updating related questions for candidates, this may take a while...')
-        # update related questions for candidates
-        counter = range(0,len(self.candidates),100)
-        for i,c in enumerate(self.candidates):
-            if i in counter:
-                print('Question',i,'of',len(self.candidates),'(counting per 100)')
-            cq = self.questions[self.qs.id2q[c]]
-            related, candidates = self.qr.relate_question(cq)
+        # update related questions for candidates, in n_process processes
+        self.candidates.extend(self.refresher.next_batch(len(self.refresher))) # including those marked to be refreshed in the background
+        self.candidates = list(set(self.candidates))
+        updated = [self.questions[self.qs.id2q[c]] for c in self.candidates]
+        for cq,(related,candidates) in zip(updated,self.relate_questions(updated,n_process)):
             cq.set_related(related)
         print('Done. Writing data')
-        self.save()
+        self.save(updated)
         self.candidates = []
         
 
@@ -323,6 +627,61 @@ class Relate:
         self.relate_many(qpath)
 
 
+
+def export_questions():
+    """
+    Function to write all questions in the question store (including those added or changed since the last compaction) 
+        to the legacy json files
+    """
+    store = question_store.QuestionStore(questionspath,questionslogpath)
+    questions = []
+    for qd in store.iterate():
+        qobj = question.Question()
+        qobj.import_qdict(qd)
+        questions.append(qobj)
+    print('Writing',len(questions),'questions to',questionspath,'and',related_questionspath)
+    store.compact(questions,related_questionspath)
+
+def load_word2vec():
+    """
+    Function to load the word2vec vectors as KeyedVectors, opened with mmap so that they are read from disk on use
+    The vectors are extracted from the full Word2Vec model and stored next to it the first time
+    """
+    if not os.path.exists(vectorspath):
+        print('Extracting word vectors from',w2vpath,'to',vectorspath)
+        Word2Vec.load(w2vpath).wv.save(vectorspath)
+    return KeyedVectors.load(vectorspath,mmap='r')
+
+def compile_topics():
+    """
+    Function to compile the commonness and entropy scores of topic segments into the tables used by the topic extractor,
+        which are opened as a memory map by every process that extracts topics
+    """
+    if os.path.exists(topicspath):
+        os.remove(topicspath)
+    topic_extractor.TopicExtractor(commonness_path,entropy_path,topicspath)
+
+def build_dense():
+    """
+    Function to build the dense index of question vectors used by the 'dense' and 'hybrid' retrievers, and write it to its file
+    """
+    if os.path.exists(densepath):
+        os.remove(densepath)
+    Relate(retriever='dense')
+
+def build_termsim(k=100,threshold=0.3):
+    """
+    Function to compute the sparse term-similarity matrix used by TRLM and SoftCosine, 
+        based on the word2vec embeddings of the terms in the dictionary, and store it next to the dictionary
+    """
+    d = Dictionary.load(dictpath)
+    word2vec = load_word2vec()
+    print('Computing term similarities')
+    ts = termsim.TermSimilarity(d)
+    ts.build(encoder.Encoder(word2vec,d),k,threshold)
+    print('Done. Saving to',termsimpath)
+    ts.save(termsimpath)
+
     ############
     ### MAIN ###
     ############
@@ -333,13 +692,30 @@ if __name__ == '__main__':
     usage: 
         python qrel/modules/relate.py test
         python qrel/modules/relate.py test_many
-        python qrel/modules/relate.py [new_questions.json]
+        python qrel/modules/relate.py termsim
+        python qrel/modules/relate.py snapshot
+        python qrel/modules/relate.py topics
+        python qrel/modules/relate.py dense
+        python qrel/modules/relate.py export
+        python qrel/modules/relate.py [new_questions.json] [number of processes]
     """
     arg = sys.argv[1]
-    model = Relate()
-    if arg == 'test':
-        model.test_relate()
-    elif arg == 'test_many':
-        model.test_relate_many()
+    if arg == 'termsim':
+        build_termsim()
+    elif arg == 'topics':
+        compile_topics()
+    elif arg == 'dense':
+        build_dense()
+    elif arg == 'export':
+        export_questions()
+    elif arg == 'snapshot':
+        model = Relate(lazy=False)
+        model.write_snapshot()
     else:
-        model.relate_many(arg)
+        model = Relate()
+        if arg == 'test':
+            model.test_relate()
+        elif arg == 'test_many':
+            model.test_relate_many()
+        else:
+            model.relate_many(arg,int(sys.argv[2]) if len(sys.argv) > 2 else 1)